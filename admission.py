@@ -0,0 +1,158 @@
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status_code, message, retry_after):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Bounded concurrency plus a bounded wait queue for one class of routes.
+
+    At most `concurrency` requests run inside `slot()` at once and at most
+    `queue_size` more wait for a turn. Everything past that is rejected
+    straight away so the gunicorn threads stay free for other routes.
+
+    Routes call `reserve()` before reading the request body. It takes one
+    of those places or rejects with 429 right away; `slot(reservation=...)`
+    then runs in that place, or waits in it for a turn, and never sheds the
+    request for a full queue after its body was paid for. A reservation
+    that never reaches `slot()` must be released.
+    """
+
+    def __init__(self, name, concurrency, queue_size, max_wait):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.queue_size = max(0, queue_size)
+        self.max_wait = max_wait
+
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)
+        self._active = 0
+        self._queued = 0
+        self._reserved = 0
+
+        # Counters
+        self._admitted = 0
+        self._rejected_queue_full = 0
+        self._rejected_timeout = 0
+        self._service_time_avg = None
+
+    def reserve(self):
+        with self._lock:
+            # 429: Every place is running, waiting or reserved
+            if self._active + self._queued + self._reserved >= self.concurrency + self.queue_size:
+                self._rejected_queue_full += 1
+                raise AdmissionRejected(429, 'Server is busy, please try again later', self._retry_after())
+            self._reserved += 1
+        return Reservation(self)
+
+    def _cancel(self, reservation):
+        with self._lock:
+            if reservation.held:
+                reservation.held = False
+                self._reserved -= 1
+
+    @contextmanager
+    def slot(self, max_wait=None, reservation=None):
+        self._acquire(self.max_wait if max_wait is None else min(max_wait, self.max_wait), reservation)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - started)
+
+    def _acquire(self, max_wait, reservation=None):
+        with self._lock:
+            reserved = reservation is not None and reservation.held
+            if reserved:
+                # The reserved place becomes a running or a waiting one
+                reservation.held = False
+                self._reserved -= 1
+            # Unreserved callers leave the reserved places free
+            ahead = self._queued if reserved else self._queued + self._reserved
+            if self._active < self.concurrency and ahead == 0:
+                self._active += 1
+                self._admitted += 1
+                return
+
+            # 429: Queue full, shed immediately
+            if not reserved and self._active + ahead >= self.concurrency + self.queue_size:
+                self._rejected_queue_full += 1
+                raise AdmissionRejected(429, 'Server is busy, please try again later', self._retry_after())
+
+            self._queued += 1
+            deadline = time.monotonic() + max_wait
+            try:
+                while self._active >= self.concurrency:
+                    remaining = deadline - time.monotonic()
+                    # 503: Waited too long for a slot
+                    if remaining <= 0:
+                        self._rejected_timeout += 1
+                        raise AdmissionRejected(503, 'Server is busy, please try again later', self._retry_after())
+                    self._slot_freed.wait(remaining)
+            finally:
+                self._queued -= 1
+
+            self._active += 1
+            self._admitted += 1
+
+    def _release(self, elapsed):
+        with self._lock:
+            self._active -= 1
+            if self._service_time_avg is None:
+                self._service_time_avg = elapsed
+            else:
+                # Exponential moving average, only used for Retry-After hints
+                self._service_time_avg = 0.8 * self._service_time_avg + 0.2 * elapsed
+            self._slot_freed.notify()
+
+    def _retry_after(self):
+        # Time for the current backlog to drain, rounded up to whole seconds
+        service_time = self._service_time_avg or 1.0
+        backlog = self._active + self._queued + self._reserved
+        return max(1, math.ceil(service_time * backlog / self.concurrency))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'concurrency': self.concurrency,
+                'queue_size': self.queue_size,
+                'active': self._active,
+                'queue_depth': self._queued,
+                'reserved': self._reserved,
+                'admitted': self._admitted,
+                'rejected_queue_full': self._rejected_queue_full,
+                'rejected_timeout': self._rejected_timeout
+            }
+
+
+class Reservation:
+    """A place taken by `AdmissionController.reserve()`, used up by `slot()`."""
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.held = True
+
+    def release(self):
+        # No-op once slot() has used the place
+        self.controller._cancel(self)
+
+
+def create_inference_controller(web_threads, concurrency, queue_size, max_wait, reserved_threads):
+    # Cap what inference may hold so `reserved_threads` always serve the other routes
+    if reserved_threads >= web_threads:
+        logging.warning('INFERENCE_RESERVED_THREADS=%s leaves no thread for inference out of %s, reserving %s instead',
+                        reserved_threads, web_threads, web_threads - 1)
+        reserved_threads = web_threads - 1
+    available = web_threads - reserved_threads
+    concurrency = min(concurrency, available)
+    queue_size = min(queue_size, available - concurrency)
+    return AdmissionController('inference', concurrency, queue_size, max_wait)
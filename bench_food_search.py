@@ -0,0 +1,130 @@
+"""Benchmark FoodIndex build time, memory and query latency.
+
+    python bench_food_search.py --sizes 10000 100000 --output search.json
+
+Builds synthetic catalogs shaped like food_nutrients (Indonesian name,
+English name, aliases) and times uncached queries of different kinds:
+short and long prefixes, two-word queries and typos. Cached latency is
+what a repeated query costs.
+"""
+import argparse
+import json
+import random
+import time
+import tracemalloc
+from food_search import FoodIndex
+
+ID_WORDS = ['nasi', 'ayam', 'goreng', 'bakar', 'rebus', 'telur', 'ikan', 'tempe', 'tahu', 'mie', 'sayur', 'sapi',
+            'kambing', 'udang', 'cumi', 'kuah', 'pedas', 'manis', 'santan', 'sambal', 'kecap', 'bumbu', 'kuning',
+            'putih', 'merah', 'hijau', 'jagung', 'kentang', 'bayam', 'kangkung', 'brokoli', 'jeruk', 'roti', 'susu']
+EN_WORDS = ['rice', 'chicken', 'fried', 'grilled', 'boiled', 'egg', 'fish', 'tempeh', 'tofu', 'noodle', 'vegetable',
+            'beef', 'goat', 'shrimp', 'squid', 'soup', 'spicy', 'sweet', 'coconut', 'chili', 'soy', 'sauce', 'yellow',
+            'white', 'red', 'green', 'corn', 'potato', 'spinach', 'broccoli', 'orange', 'bread', 'milk']
+
+
+def make_catalog(size, seed=0):
+    rng = random.Random(seed)
+    catalog = {}
+    while len(catalog) < size:
+        name_id = ' '.join(rng.sample(ID_WORDS, rng.randint(1, 4)))
+        label = f'{name_id.replace(" ", "_")}_{len(catalog)}'
+        catalog[label] = {
+            'prot': round(rng.random() * 0.3, 3),
+            'fat': round(rng.random() * 0.3, 3),
+            'carbs': round(rng.random() * 0.6, 3),
+            'name_id': name_id.title(),
+            'name_en': ' '.join(rng.sample(EN_WORDS, rng.randint(1, 4))).title(),
+            'aliases': [' '.join(rng.sample(ID_WORDS, 2)) for _ in range(rng.randint(0, 2))]
+        }
+    return catalog
+
+
+def make_queries(rng, count):
+    def typo(word):
+        i = rng.randrange(len(word))
+        return word[:i] + word[i + 1:]
+
+    return {
+        'prefix_1': [rng.choice(ID_WORDS)[:1] for _ in range(count)],
+        'prefix_3': [rng.choice(ID_WORDS + EN_WORDS)[:3] for _ in range(count)],
+        'prefix_6': [rng.choice(ID_WORDS + EN_WORDS)[:6] for _ in range(count)],
+        'two_words': [f'{rng.choice(ID_WORDS)} {rng.choice(ID_WORDS)[:3]}' for _ in range(count)],
+        'typo': [typo(rng.choice(ID_WORDS)) for _ in range(count)]
+    }
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def time_queries(index, queries, cached):
+    latencies = []
+    for query in queries:
+        if not cached:
+            index._results = {}
+        started = time.perf_counter()
+        index.search(query)
+        latencies.append((time.perf_counter() - started) * 1e6)
+    return {
+        'p50_us': round(percentile(latencies, 50), 1),
+        'p99_us': round(percentile(latencies, 99), 1),
+        'max_us': round(max(latencies), 1)
+    }
+
+
+def bench(size, queries_per_kind):
+    catalog = make_catalog(size)
+
+    # Memory on a separate build, tracemalloc slows the build down several times
+    tracemalloc.start()
+    measured = FoodIndex()
+    measured.load(catalog)
+    index_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del measured
+
+    started = time.perf_counter()
+    index = FoodIndex()
+    index.load(catalog)
+    build_seconds = time.perf_counter() - started
+
+    # Incremental update of one food
+    label = next(iter(catalog))
+    started = time.perf_counter()
+    index.upsert(label, dict(catalog[label], aliases=['menu baru']))
+    upsert_us = (time.perf_counter() - started) * 1e6
+
+    rng = random.Random(1)
+    result = {
+        'foods': size,
+        'build_seconds': round(build_seconds, 3),
+        'index_mb': round(index_bytes / (1024 * 1024), 1),
+        'upsert_us': round(upsert_us, 1),
+        'queries': {}
+    }
+    for kind, queries in make_queries(rng, queries_per_kind).items():
+        result['queries'][kind] = {
+            'uncached': time_queries(index, queries, cached=False),
+            'cached': time_queries(index, queries, cached=True)
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--queries', type=int, default=500, help='Queries per kind')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    report = [bench(size, args.queries) for size in args.sizes]
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""Benchmark the scan_nutrition classifier path stage by stage.
+
+    python bench_inference.py --images samples/ --model model.h5 --model model_int8.tflite \
+        --threads 0:0 1:1 2:1 4:1 --batch-sizes 1 4 8 --image-sizes 0 1280 640 --output bench.json
+
+The three stages of the request path are timed separately over a folder of
+local images:
+
+- decode: `load_img` (read, decode and resize to the model input)
+- preprocess: `img_to_array`, scaling and batching
+- predict: `model.predict` for each batch size
+
+Source photos are first re-encoded as JPEG with the longest side set to
+each --image-sizes value (0 keeps the originals), since upload resolution
+drives decode cost. TensorFlow thread pools can only be set before the
+runtime starts, so each model and --threads setting (`intra:inter`, 0 lets
+TensorFlow decide) runs in its own subprocess and reports its own peak
+RSS. The JSON report records the commit and environment so runs can be
+compared across commits.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from PIL import Image
+from quantize_model import list_images
+
+
+def percentile_ms(values, p):
+    return round(float(np.percentile(values, p)) * 1000, 3)
+
+
+def summarize(seconds, images_per_call=1):
+    total = sum(seconds)
+    return {
+        'calls': len(seconds),
+        'p50_ms': percentile_ms(seconds, 50),
+        'p99_ms': percentile_ms(seconds, 99),
+        'mean_ms': round(total / len(seconds) * 1000, 3),
+        'images_per_second': round(len(seconds) * images_per_call / total, 2) if total else None
+    }
+
+
+def resize_sources(paths, longest_side):
+    # Encoded JPEG bytes at the requested resolution, as a client would upload them
+    encoded = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            data = f.read()
+        if longest_side:
+            img = Image.open(io.BytesIO(data)).convert('RGB')
+            img.thumbnail((longest_side, longest_side))
+            buffer = io.BytesIO()
+            img.save(buffer, format='JPEG', quality=90)
+            data = buffer.getvalue()
+        encoded.append(data)
+    return encoded
+
+
+def run_worker(args):
+    from inference import IMAGE_SIZE, configure_tf_threads, load_classifier, warm_up
+    from tensorflow.keras.utils import img_to_array, load_img
+
+    intra_op, inter_op = parse_threads(args.threads[0])
+    configure_tf_threads(intra_op, inter_op)
+    paths = list_images(args.images)[:args.limit]
+
+    started = time.perf_counter()
+    # configure_tf_threads only reaches Keras models, a TFLite interpreter takes its own count
+    model = load_classifier(args.model[0], num_threads=intra_op or None)
+    warm_up(model)
+    load_seconds = time.perf_counter() - started
+
+    results = []
+    for image_size in args.image_sizes:
+        sources = resize_sources(paths, image_size)
+
+        decode_seconds = []
+        preprocess_seconds = []
+        arrays = []
+        for data in sources:
+            started = time.perf_counter()
+            img = load_img(io.BytesIO(data), target_size=IMAGE_SIZE)
+            decoded = time.perf_counter()
+            x = img_to_array(img)
+            x /= 255
+            x = np.expand_dims(x, axis=0)
+            preprocess_seconds.append(time.perf_counter() - decoded)
+            decode_seconds.append(decoded - started)
+            arrays.append(x[0])
+
+        predict = {}
+        for batch_size in args.batch_sizes:
+            batches = [
+                np.stack([arrays[(i * batch_size + j) % len(arrays)] for j in range(batch_size)])
+                for i in range(args.iterations)
+            ]
+            # The first call at a new batch shape may retrace, keep it out of the numbers
+            model.predict(batches[0], batch_size=batch_size, verbose=0)
+            seconds = []
+            for batch in batches:
+                started = time.perf_counter()
+                model.predict(batch, batch_size=batch_size, verbose=0)
+                seconds.append(time.perf_counter() - started)
+            predict[str(batch_size)] = summarize(seconds, batch_size)
+
+        results.append({
+            'image_size': image_size or 'original',
+            'source_kb_mean': round(sum(len(data) for data in sources) / len(sources) / 1024, 1),
+            'decode': summarize(decode_seconds),
+            'preprocess': summarize(preprocess_seconds),
+            'predict': predict
+        })
+
+    report = {
+        'model': args.model[0],
+        'intra_op_threads': intra_op,
+        'inter_op_threads': inter_op,
+        'images': len(paths),
+        'load_seconds': round(load_seconds, 3),
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'results': results
+    }
+    # Not stdout, TensorFlow and Keras print there
+    with open(args.output, 'w') as f:
+        json.dump(report, f)
+
+
+def parse_threads(value):
+    intra_op, _, inter_op = value.partition(':')
+    return int(intra_op), int(inter_op or 0)
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', required=True, help='Folder of sample photos')
+    parser.add_argument('--model', action='append', help='Model file, repeat to compare backends (default model.h5)')
+    parser.add_argument('--threads', nargs='+', default=['0:0'], help='intra:inter TensorFlow thread settings')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--image-sizes', type=int, nargs='+', default=[0], help='Longest side of the source photos, 0 keeps them')
+    parser.add_argument('--iterations', type=int, default=50, help='Predict calls per batch size')
+    parser.add_argument('--limit', type=int, default=200, help='Images used from the folder')
+    parser.add_argument('--output')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.model = args.model or ['model.h5']
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    if not list_images(args.images):
+        raise SystemExit(f'No images found in {args.images}')
+
+    runs = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for model in args.model:
+            for threads in args.threads:
+                run_output = os.path.join(tmp_dir, f'run-{len(runs)}.json')
+                command = [
+                    sys.executable, os.path.abspath(__file__), '--worker',
+                    '--images', args.images, '--model', model, '--threads', threads,
+                    '--batch-sizes', *map(str, args.batch_sizes),
+                    '--image-sizes', *map(str, args.image_sizes),
+                    '--iterations', str(args.iterations), '--limit', str(args.limit),
+                    '--output', run_output
+                ]
+                print(f'{model} threads={threads}', file=sys.stderr)
+                completed = subprocess.run(command)
+                if completed.returncode != 0:
+                    runs.append({'model': model, 'threads': threads, 'error': f'exit code {completed.returncode}'})
+                    continue
+                with open(run_output) as f:
+                    runs.append(json.load(f))
+
+    output = json.dumps({'environment': environment(), 'runs': runs}, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
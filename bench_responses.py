@@ -0,0 +1,139 @@
+"""Benchmark JSON encoding and compression of dashboard responses.
+
+    python bench_responses.py --meals 3 30 300 --output responses.json
+
+Builds dashboard payloads shaped like /master/dashboard (user block from
+utils.profile_response, graph and history_food) with a given number of
+meals. It measures CPU time
+per response for the stdlib encoder as Flask calls it and for orjson, and
+bytes on the wire uncompressed, gzipped and brotli-compressed at the
+levels responses.py uses. Encoders or compressors that are not installed
+are skipped.
+"""
+import argparse
+import gzip
+import json
+import random
+import time
+from utils import build_user_profile, profile_response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+TITLES = ['nasi goreng', 'ayam bakar', 'tempe goreng', 'sayur asem', 'soto ayam', 'bakso', 'gado gado',
+          'mie ayam', 'rendang', 'ikan bakar', 'tahu goreng', 'telur dadar', 'pecel lele', 'sate ayam']
+
+
+USER_ID = '-NjEtLWvhlL1rak30Xwd'
+
+
+def make_payload(meals, seed=0):
+    rng = random.Random(seed)
+    profile = build_user_profile('Siti Rahmawati', '1998-04-12', 'siti.rahmawati@example.com', 158, 54, 'F', 'M')
+    targets = profile['targets']
+
+    def meal():
+        return {
+            'image_url': f'https://storage.googleapis.com/capstone-project-nutrimatch.appspot.com/food_images/{USER_ID}/{rng.getrandbits(256):064x}.jpg',
+            'title': ', '.join(rng.sample(TITLES, rng.randint(1, 3))),
+            'nutrition_info': {
+                'calories': round(rng.uniform(100, 900), 2),
+                'protein': round(rng.uniform(2, 60), 2),
+                'fat': round(rng.uniform(1, 50), 2),
+                'carb': round(rng.uniform(5, 120), 2)
+            }
+        }
+
+    history = {'breakfast': [], 'lunch': [], 'dinner': []}
+    for i in range(meals):
+        history[('breakfast', 'lunch', 'dinner')[i % 3]].append(meal())
+
+    return {
+        'status': True,
+        'message': 'Success get dashboard',
+        'data': {
+            'user': profile_response(USER_ID, profile),
+            'graph': {
+                name: {'target': targets[name], 'current': round(rng.uniform(0, targets[name]), 2)}
+                for name in ('calories', 'protein', 'fat', 'carbs')
+            },
+            'history_food': history
+        }
+    }
+
+
+def cpu_us(fn, repeat):
+    started = time.process_time()
+    for _ in range(repeat):
+        fn()
+    return round((time.process_time() - started) / repeat * 1e6, 1)
+
+
+def encoders():
+    # What Flask's DefaultJSONProvider produces, compact and with app.debug
+    found = {
+        'stdlib': lambda obj: json.dumps(obj, sort_keys=True, ensure_ascii=True, separators=(',', ':')).encode('utf-8'),
+        'stdlib_indent': lambda obj: json.dumps(obj, sort_keys=True, ensure_ascii=True, indent=2).encode('utf-8')
+    }
+    if orjson is not None:
+        found['orjson'] = lambda obj: orjson.dumps(obj, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+        found['orjson_indent'] = lambda obj: orjson.dumps(obj, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_INDENT_2)
+    return found
+
+
+def compressors():
+    found = {
+        'gzip_1': lambda data: gzip.compress(data, compresslevel=1),
+        'gzip_6': lambda data: gzip.compress(data, compresslevel=6)
+    }
+    if brotli is not None:
+        found['brotli_4'] = lambda data: brotli.compress(data, quality=4)
+        found['brotli_11'] = lambda data: brotli.compress(data, quality=11)
+    return found
+
+
+def bench(meals, repeat):
+    payload = make_payload(meals)
+    result = {'meals': meals, 'encoders': {}, 'compression': {}}
+
+    for name, encode in encoders().items():
+        result['encoders'][name] = {
+            'cpu_us': cpu_us(lambda: encode(payload), repeat),
+            'bytes': len(encode(payload))
+        }
+
+    # Compress the compact body, which is what production sends
+    body = encoders()['orjson' if orjson is not None else 'stdlib'](payload)
+    for name, compress in compressors().items():
+        result['compression'][name] = {
+            'cpu_us': cpu_us(lambda: compress(body), repeat),
+            'bytes': len(compress(body)),
+            'ratio': round(len(body) / len(compress(body)), 2)
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--meals', type=int, nargs='+', default=[3, 30, 300])
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    report = [bench(meals, args.repeat) for meals in args.meals]
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
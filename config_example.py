@@ -1,2 +1,57 @@
 secret_key = ''  # secret key untuk JWT
 FIREBASE_AUTH_API = '' 
+
+# Process sizing, 0 derives the value from the container's CPU/memory limits (see runtime_config.py)
+GUNICORN_WORKERS = 0
+GUNICORN_THREADS = 0  # threads per worker
+WORKER_MEMORY_MB = 1024  # memory one worker needs, caps the derived worker count
+INFERENCE_CONCURRENCY = 0  # predictions running at the same time per worker
+
+# Admission control for inference routes
+INFERENCE_QUEUE_SIZE = 4  # requests allowed to wait for a prediction slot
+INFERENCE_QUEUE_TIMEOUT = 5.0  # seconds a queued request waits before 503
+INFERENCE_RESERVED_THREADS = 2  # threads never handed to inference routes
+
+# Classifier: model.h5 or a quantized .tflite from quantize_model.py
+MODEL_PATH = 'model.h5'
+MODEL_POLL_INTERVAL = 30  # seconds between checks for a new model version, 0 disables hot reload
+
+# TensorFlow thread pools per gunicorn worker, 0 derives them from the CPU limit
+TF_INTRA_OP_THREADS = 0
+TF_INTER_OP_THREADS = 0
+
+# Image checks before inference, 0 disables a check
+IMAGE_MIN_SIDE = 64  # pixels, shortest side
+IMAGE_DARK_THRESHOLD = 20  # mean brightness (0-255) below this is too dark
+IMAGE_BRIGHT_THRESHOLD = 235  # mean brightness above this is too bright
+IMAGE_BLUR_THRESHOLD = 40  # Laplacian variance at 256px below this is blurry
+
+# Request deadlines in seconds; clients can ask for less with an X-Request-Timeout header
+REQUEST_TIMEOUT = 15.0
+ROUTE_TIMEOUTS = {
+    '/master/scan_nutrition': 30.0,
+    '/master/scan_and_submit': 30.0,
+    '/profile/export': 300.0
+}
+BACKEND_TIMEOUT = 10.0  # longest single Firebase, Storage or HTTP call
+
+# Meals older than this move to monthly archives in the bucket (see meal_archive.py)
+MEAL_ARCHIVE_AFTER_DAYS = 90
+
+# Response compression (brotli when installed, else gzip) for bodies of at least this many bytes
+COMPRESSION_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+
+# Flask debug mode, also pretty-prints every JSON response; keep off in production
+DEBUG = False
+
+# Per-request profiling, off unless a secret or a sample rate is set (see profiling.py)
+PROFILE_SECRET = ''  # signs X-Profile-Request headers
+PROFILE_SAMPLE_RATE = 0.0  # fraction of requests profiled without a header
+PROFILE_MODE = 'cprofile'  # or 'sample' for a stack-sampling profile
+PROFILE_DIR = '/tmp/profiles'
+
+# Direct-to-storage uploads: lifetime of signed upload URLs in seconds.
+# Point STORAGE_EMULATOR_HOST (environment) at a local emulator for development.
+UPLOAD_URL_EXPIRATION = 300
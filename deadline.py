@@ -0,0 +1,95 @@
+"""Per-request deadlines.
+
+Every request gets a deadline when it starts: the route's entry in
+ROUTE_TIMEOUTS, REQUEST_TIMEOUT otherwise, shortened by an
+`X-Request-Timeout: <seconds>` header when the client will give up
+sooner. Code on the request path asks `remaining()` for the budget left
+and passes it to whatever it is about to wait on; `remaining(default)`
+caps that at a per-call timeout such as BACKEND_TIMEOUT, so one slow call
+cannot use up the whole request. Once the deadline has passed
+`remaining()` raises DeadlineExceeded and the request ends with a 504
+instead of holding a thread for a client that is gone.
+
+A backend timeout (DEADLINE_ERRORS) is only a 504 when the request's
+deadline has passed; before that it is a per-call timeout and a 503.
+
+Outside a request (scripts, background threads) there is no deadline and
+`remaining(default)` returns `default`.
+"""
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import requests
+from firebase_admin import exceptions as firebase_exceptions
+from flask import g, has_request_context, jsonify, request
+
+HEADER = 'X-Request-Timeout'
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+# Everything a backend call raises when it ran out of time. FutureTimeoutError is
+# the builtin TimeoutError on Python 3.11+, so socket timeouts land here too
+DEADLINE_ERRORS = (
+    DeadlineExceeded,
+    firebase_exceptions.DeadlineExceededError,
+    requests.exceptions.Timeout,
+    FutureTimeoutError
+)
+
+
+def remaining(default=None):
+    if not has_request_context() or 'deadline' not in g:
+        return default
+    left = g.deadline - time.monotonic()
+    if left <= 0:
+        raise DeadlineExceeded('Request deadline exceeded')
+    return left if default is None else min(left, default)
+
+
+def expired():
+    return has_request_context() and 'deadline' in g and time.monotonic() >= g.deadline
+
+
+def check():
+    # Raise if the current request is already past its deadline
+    remaining()
+
+
+def init_deadlines(app, default_timeout, route_timeouts=None):
+    route_timeouts = route_timeouts or {}
+
+    @app.before_request
+    def start_deadline():
+        rule = request.url_rule.rule if request.url_rule else None
+        timeout = route_timeouts.get(rule, default_timeout)
+        header = request.headers.get(HEADER)
+        if header:
+            try:
+                # The client can only shorten the budget
+                timeout = min(timeout, max(0.0, float(header)))
+            except ValueError:
+                pass
+        g.deadline = time.monotonic() + timeout
+
+    def handle_deadline_exceeded(e):
+        # 503: One backend call timed out while the request still had time
+        if not isinstance(e, DeadlineExceeded) and not expired():
+            response = {
+                'status': False,
+                'message': 'Service unavailable, please try again',
+                'data': None
+            }
+            return jsonify(response), 503
+
+        # 504: Ran out of time
+        response = {
+            'status': False,
+            'message': 'Request timed out',
+            'data': None
+        }
+        return jsonify(response), 504
+
+    for error in DEADLINE_ERRORS:
+        app.register_error_handler(error, handle_deadline_exceeded)
@@ -0,0 +1,113 @@
+"""Compare a quantized classifier against the original on a labeled dataset.
+
+    python evaluate_quantized.py --reference model.h5 \
+        --candidate model_dynamic.tflite --candidate model_int8.tflite \
+        --dataset labeled/ --output report.json
+
+The dataset folder has one sub-folder per class label (ayam/, nasi/, ...).
+For every class the report gives how often the candidate takes the same
+above-threshold decision as the reference, and how often each model
+detects the folder's own label. It also reports per-image latency and
+the memory each model adds to the process.
+"""
+import argparse
+import json
+import os
+import time
+import numpy as np
+from inference import DETECTION_THRESHOLD, get_rss_mb, load_classifier, preprocess_image
+from quantize_model import list_images
+from utils import CLASS_LABELS
+
+
+def load_dataset(dataset_dir):
+    samples = []
+    for label in CLASS_LABELS:
+        for path in list_images(os.path.join(dataset_dir, label)):
+            samples.append((path, CLASS_LABELS.index(label)))
+    if not samples:
+        raise SystemExit(f'No labeled images found in {dataset_dir}')
+    return samples
+
+
+def run_model(model_path, inputs):
+    rss_before = get_rss_mb()
+    model = load_classifier(model_path)
+    # Warm up so one-off graph tracing is not counted as latency
+    model.predict(inputs[0], batch_size=1)
+    rss_after = get_rss_mb()
+
+    scores = []
+    latencies = []
+    for x in inputs:
+        started = time.perf_counter()
+        scores.append(model.predict(x, batch_size=1)[0])
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    return np.array(scores), {
+        'model_path': model_path,
+        'file_size_mb': round(os.path.getsize(model_path) / (1024 * 1024), 2),
+        'model_rss_mb': round(rss_after - rss_before, 1),
+        'latency_ms': {
+            'mean': round(float(np.mean(latencies)), 2),
+            'p50': round(float(np.percentile(latencies, 50)), 2),
+            'p99': round(float(np.percentile(latencies, 99)), 2)
+        }
+    }
+
+
+def per_class_report(reference_scores, candidate_scores, truth, threshold):
+    reference_detected = reference_scores > threshold
+    candidate_detected = candidate_scores > threshold
+
+    report = {}
+    for idx, label in enumerate(CLASS_LABELS):
+        in_class = truth == idx
+        report[label] = {
+            'images': int(in_class.sum()),
+            'agreement': round(float(np.mean(reference_detected[:, idx] == candidate_detected[:, idx])), 4),
+            'reference_recall': round(float(reference_detected[in_class, idx].mean()), 4) if in_class.any() else None,
+            'candidate_recall': round(float(candidate_detected[in_class, idx].mean()), 4) if in_class.any() else None
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reference', default='model.h5')
+    parser.add_argument('--candidate', action='append', required=True)
+    parser.add_argument('--dataset', required=True)
+    parser.add_argument('--threshold', type=float, default=DETECTION_THRESHOLD)
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    samples = load_dataset(args.dataset)
+    truth = np.array([label for _, label in samples])
+    inputs = [preprocess_image(path) for path, _ in samples]
+
+    reference_scores, reference_stats = run_model(args.reference, inputs)
+    report = {
+        'images': len(samples),
+        'threshold': args.threshold,
+        'reference': reference_stats,
+        'candidates': []
+    }
+
+    for candidate_path in args.candidate:
+        candidate_scores, candidate_stats = run_model(candidate_path, inputs)
+        reference_detected = reference_scores > args.threshold
+        candidate_detected = candidate_scores > args.threshold
+        candidate_stats['exact_match'] = round(float(np.mean(np.all(reference_detected == candidate_detected, axis=1))), 4)
+        candidate_stats['per_class'] = per_class_report(reference_scores, candidate_scores, truth, args.threshold)
+        report['candidates'].append(candidate_stats)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+import logging
+import re
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+from firebase_admin import db
+
+MAX_PREFIX_LENGTH = 12
+MIN_TRIGRAM_SCORE = 0.34
+MAX_FUZZY_POSTINGS = 1000
+MAX_CACHED_RESULTS = 10000
+
+
+def normalize(text):
+    # 'Tempé Goreng!' -> 'tempe goreng'
+    text = unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', text.lower()).split())
+
+
+def trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class FoodIndex:
+    """In-memory search index over the food_nutrients catalog.
+
+    Every name of a food (its key, name_id, name_en and aliases) is indexed
+    by its own prefixes and by the prefixes of each of its words, so "nas"
+    and "gor" both find "Nasi Goreng". Each posting list is kept sorted by
+    rank (shortest name first), so a query reads only the first `limit`
+    entries it needs instead of ranking every match. A trigram index
+    catches typos when prefixes find too little.
+
+    Updates touch only the food that changed and only drop the cached
+    results that food could appear in. Updates are rare, so a single lock
+    around updates and queries costs nothing in practice.
+    """
+
+    def __init__(self, path='food_nutrients'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._foods = {}
+        self._rank = {}
+        self._name_prefixes = {}
+        self._word_prefixes = {}
+        self._trigrams = {}
+        self._results = {}
+        self.ready = False
+
+    def __len__(self):
+        return len(self._foods)
+
+    def load(self, catalog):
+        foods = {}
+        rank = {}
+        name_prefixes = {}
+        word_prefixes = {}
+        grams = {}
+        for label, food in (catalog or {}).items():
+            if not isinstance(food, dict):
+                continue
+            names = self._names(label, food)
+            foods[label] = (names, food)
+            rank[label] = (len(names[0]), label)
+            name_keys, word_keys, gram_keys = self._keys(names)
+            for key in name_keys:
+                name_prefixes.setdefault(key, []).append(label)
+            for key in word_keys:
+                word_prefixes.setdefault(key, []).append(label)
+            for key in gram_keys:
+                grams.setdefault(key, set()).add(label)
+
+        # Sort every posting list once instead of inserting in order
+        for postings in (name_prefixes, word_prefixes):
+            for labels in postings.values():
+                labels.sort(key=rank.__getitem__)
+
+        with self._lock:
+            self._foods = foods
+            self._rank = rank
+            self._name_prefixes = name_prefixes
+            self._word_prefixes = word_prefixes
+            self._trigrams = grams
+            self._results = {}
+            self.ready = True
+
+    def upsert(self, label, food):
+        if not isinstance(food, dict):
+            food = None
+        with self._lock:
+            words = set()
+            old = self._foods.pop(label, None)
+            if old is not None:
+                words.update(word for name in old[0] for word in name.split())
+                self._unindex(label, old[0])
+                del self._rank[label]
+            if food is not None:
+                names = self._names(label, food)
+                words.update(word for name in names for word in name.split())
+                self._foods[label] = (names, food)
+                self._rank[label] = (len(names[0]), label)
+                self._index(label, names)
+            self._invalidate(words)
+
+    def remove(self, label):
+        self.upsert(label, None)
+
+    @staticmethod
+    def _names(label, food):
+        names = [label.replace('_', ' '), food.get('name_id'), food.get('name_en')]
+        aliases = food.get('aliases') or []
+        if isinstance(aliases, dict):
+            aliases = list(aliases.values())
+        names.extend(aliases)
+        # Shortest first, the rank uses names[0]
+        normalized = {normalize(name) for name in names if name}
+        return sorted((name for name in normalized if name), key=lambda name: (len(name), name))
+
+    @staticmethod
+    def _keys(names):
+        name_keys = set()
+        word_keys = set()
+        gram_keys = set()
+        for name in names:
+            name_keys.update(name[:length] for length in range(1, min(len(name), MAX_PREFIX_LENGTH) + 1))
+            for word in name.split():
+                word_keys.update(word[:length] for length in range(1, min(len(word), MAX_PREFIX_LENGTH) + 1))
+            gram_keys.update(trigrams(name))
+        return name_keys, word_keys, gram_keys
+
+    def _index(self, label, names):
+        name_keys, word_keys, gram_keys = self._keys(names)
+        rank = self._rank.__getitem__
+        for key in name_keys:
+            insort(self._name_prefixes.setdefault(key, []), label, key=rank)
+        for key in word_keys:
+            insort(self._word_prefixes.setdefault(key, []), label, key=rank)
+        for key in gram_keys:
+            self._trigrams.setdefault(key, set()).add(label)
+
+    def _unindex(self, label, names):
+        name_keys, word_keys, gram_keys = self._keys(names)
+        rank = self._rank[label]
+        for postings, keys in ((self._name_prefixes, name_keys), (self._word_prefixes, word_keys)):
+            for key in keys:
+                labels = postings.get(key)
+                if not labels:
+                    continue
+                i = bisect_left(labels, rank, key=self._rank.__getitem__)
+                if i < len(labels) and labels[i] == label:
+                    del labels[i]
+                if not labels:
+                    del postings[key]
+        for key in gram_keys:
+            labels = self._trigrams.get(key)
+            if labels is not None:
+                labels.discard(label)
+                if not labels:
+                    del self._trigrams[key]
+
+    def _invalidate(self, words):
+        # A cached prefix result can only change if every query word prefixes one of the changed words
+        def affected(query, fuzzy):
+            return fuzzy or all(any(word.startswith(part) for word in words) for part in query.split())
+        self._results = {key: value for key, value in self._results.items() if not affected(key[0], value[1])}
+
+    def search(self, query, limit=10):
+        query = normalize(query)
+        if not query or limit <= 0:
+            return []
+        with self._lock:
+            cached = self._results.get((query, limit))
+            if cached is None:
+                cached = self._search(query, limit)
+                if len(self._results) >= MAX_CACHED_RESULTS:
+                    self._results = {}
+                self._results[(query, limit)] = cached
+            return cached[0]
+
+    def _search(self, query, limit):
+        ranked = []
+        seen = set()
+
+        def take(labels, accept=None):
+            for label in labels:
+                if len(ranked) >= limit:
+                    return
+                if label not in seen and (accept is None or accept(label)):
+                    seen.add(label)
+                    ranked.append(label)
+
+        # 1. Names starting with the whole query (an exact name sorts first, it is the shortest)
+        take(self._name_prefixes.get(query[:MAX_PREFIX_LENGTH], ()),
+             lambda label: any(name.startswith(query) for name in self._foods[label][0]))
+
+        # 2. Every query word prefixes a word of the food's names; walk the
+        #    shortest posting list in rank order and check the other words
+        words = [word[:MAX_PREFIX_LENGTH] for word in query.split()]
+        postings = [self._word_prefixes.get(word, ()) for word in words]
+        if len(ranked) < limit and all(postings):
+            order = sorted(range(len(words)), key=lambda i: len(postings[i]))
+            others = [words[i] for i in order[1:]]
+
+            def has_all_words(label):
+                food_words = [word for name in self._foods[label][0] for word in name.split()]
+                return all(any(food_word.startswith(word) for food_word in food_words) for word in others)
+
+            take(postings[order[0]], has_all_words if others else None)
+
+        # 3. Typo tolerance, counting only the rarer trigrams to bound the work
+        fuzzy = len(ranked) < limit
+        if fuzzy:
+            query_grams = trigrams(query)
+            counts = {}
+            for gram in query_grams:
+                labels = self._trigrams.get(gram, ())
+                if len(labels) <= MAX_FUZZY_POSTINGS:
+                    for label in labels:
+                        counts[label] = counts.get(label, 0) + 1
+            candidates = sorted((-count, self._rank[label], label) for label, count in counts.items()
+                                if count / len(query_grams) >= MIN_TRIGRAM_SCORE)
+            take(label for _, _, label in candidates)
+
+        results = [{'label': label, 'names': self._foods[label][0], 'food': self._foods[label][1]} for label in ranked]
+        return results, fuzzy
+
+    def watch(self):
+        # The first event carries the whole catalog, later ones only what changed
+        return db.reference(self.path).listen(self._on_event)
+
+    def _on_event(self, event):
+        try:
+            parts = [part for part in event.path.split('/') if part]
+            if not parts:
+                if event.event_type == 'put':
+                    self.load(event.data)
+                else:
+                    for label, food in (event.data or {}).items():
+                        self.upsert(label, food)
+            elif len(parts) == 1 and event.event_type == 'put':
+                self.upsert(parts[0], event.data)
+            else:
+                # A field inside one food changed, re-read that food
+                self.upsert(parts[0], db.reference(f'{self.path}/{parts[0]}').get())
+        except Exception:
+            logging.exception('Failed to apply %s change at %s', self.path, event.path)
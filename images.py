@@ -0,0 +1,101 @@
+# Image helpers that only need PIL and numpy, so they can run in worker
+# processes without importing TensorFlow.
+import io
+import threading
+import time
+import numpy as np
+from PIL import Image
+
+IMAGE_SIZE = (416, 416)
+
+# Longest side of the grayscale thumbnail the quality checks run on
+GATE_SIZE = 256
+
+
+def decode_image_array(data, target_size=IMAGE_SIZE):
+    # Same pixels as inference.preprocess_image before scaling, as uint8 HxWx3
+    img = Image.open(io.BytesIO(data))
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    # load_img resizes with nearest neighbour by default, match it
+    img = img.resize((target_size[1], target_size[0]), Image.NEAREST)
+    return np.asarray(img, dtype=np.uint8)
+
+
+def laplacian_variance(gray):
+    # Variance of the 4-neighbour Laplacian, low for blurry images
+    center = gray[1:-1, 1:-1]
+    laplacian = gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:] - 4 * center
+    return float(laplacian.var())
+
+
+class ImageQualityGate:
+    """Rejects images the classifier cannot use before paying for inference.
+
+    `check(data)` returns None for a usable image or the reason it is not:
+    'invalid' (not a decodable image), 'too_small', 'too_dark',
+    'too_bright' or 'blurry'. The checks run on a small grayscale decode;
+    JPEG is decoded straight at reduced scale, so a photo costs a few
+    milliseconds instead of a full decode plus `model.predict`. A threshold
+    of 0 disables its check.
+    """
+
+    REASONS = ('invalid', 'too_small', 'too_dark', 'too_bright', 'blurry')
+
+    def __init__(self, min_side=64, dark_threshold=20, bright_threshold=235, blur_threshold=40):
+        self.min_side = min_side
+        self.dark_threshold = dark_threshold
+        self.bright_threshold = bright_threshold
+        self.blur_threshold = blur_threshold
+
+        self._lock = threading.Lock()
+        self._checked = 0
+        self._rejected = dict.fromkeys(self.REASONS, 0)
+        self._check_time_avg = None
+
+    def check(self, data):
+        started = time.monotonic()
+        reason = self._check(data)
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self._checked += 1
+            if reason is not None:
+                self._rejected[reason] += 1
+            if self._check_time_avg is None:
+                self._check_time_avg = elapsed
+            else:
+                self._check_time_avg = 0.9 * self._check_time_avg + 0.1 * elapsed
+        return reason
+
+    def _check(self, data):
+        try:
+            img = Image.open(io.BytesIO(data))
+            if self.min_side and min(img.size) < self.min_side:
+                return 'too_small'
+            # JPEG only: decode at 1/2, 1/4 or 1/8 scale, whatever still covers GATE_SIZE
+            img.draft('L', (GATE_SIZE, GATE_SIZE))
+            img = img.convert('L')
+            img.thumbnail((GATE_SIZE, GATE_SIZE))
+            gray = np.asarray(img, dtype=np.float32)
+        except Exception:
+            return 'invalid'
+
+        brightness = gray.mean()
+        if self.dark_threshold and brightness < self.dark_threshold:
+            return 'too_dark'
+        if self.bright_threshold and brightness > self.bright_threshold:
+            return 'too_bright'
+        if self.blur_threshold and min(gray.shape) >= 3 and laplacian_variance(gray) < self.blur_threshold:
+            return 'blurry'
+        return None
+
+    def stats(self):
+        with self._lock:
+            rejected = sum(self._rejected.values())
+            return {
+                'checked': self._checked,
+                'rejected': dict(self._rejected),
+                # Every rejected image is a decode and prediction not run
+                'inferences_saved': rejected,
+                'check_ms_avg': round(self._check_time_avg * 1000, 2) if self._check_time_avg is not None else None
+            }
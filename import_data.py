@@ -0,0 +1,348 @@
+"""Bulk import food_nutrients, users or meal history from CSV / NDJSON.
+
+    python import_data.py foods foods.csv
+    python import_data.py users users.ndjson.gz --checkpoint users.ckpt
+    python import_data.py meals meals.ndjson --batch-size 2000 --rejects bad.ndjson
+
+Rows are validated against the shapes the API writes (food_nutrients as
+read by get_nutrition_info, register for users, store_food_data for
+meals) and written in multi-path updates of --batch-size records. Input
+is streamed and only one batch is held in memory. After every batch the
+input line reached is saved to the checkpoint file; running the same
+command again resumes from there. Keys are derived from the row content,
+so replaying a batch after a crash rewrites the same records.
+
+users rows only create database records; add --create-auth to also
+import Firebase Auth accounts (without passwords, users reset them).
+Each user's users_by_email entry is claimed the way register claims it
+before the batch is written: a row whose email already belongs to another
+user is rejected as a conflict, and a row whose Auth import fails is
+rejected and its claim released. Rejected rows go to --rejects, so the
+checkpoint can still move past them.
+
+Meal timestamps with an offset are stored as naive UTC, as the API stores
+them. Every batch also bumps user_versions/<email hash> of each user it
+touched, so clients do not keep revalidating stale ETags.
+"""
+import argparse
+import csv
+import datetime
+import gzip
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from firebase_admin import auth, db
+from utils import (build_user_profile, claim_email_index, generate_push_id, hash_email, init_firebase,
+                   is_valid_email, release_email_index)
+
+INVALID_KEY_CHARS = set('.#$[]/')
+MEAL_CATEGORIES = ('breakfast', 'lunch', 'dinner')
+
+
+class InvalidRow(Exception):
+    pass
+
+
+def open_input(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, 'r', encoding='utf-8', newline='')
+
+
+def read_rows(path, skip):
+    is_csv = path[:-3].endswith('.csv') if path.endswith('.gz') else path.endswith('.csv')
+    with open_input(path) as f:
+        rows = csv.DictReader(f) if is_csv else f
+        for line_number, row in enumerate(rows, start=1):
+            if line_number <= skip:
+                continue
+            if not is_csv:
+                row = row.strip()
+                if not row:
+                    continue
+                try:
+                    row = json.loads(row)
+                except ValueError as e:
+                    yield line_number, None, f'invalid JSON: {e}'
+                    continue
+            yield line_number, row, None
+
+
+def require(row, *fields):
+    missing = [field for field in fields if row.get(field) in (None, '')]
+    if missing:
+        raise InvalidRow('missing ' + ', '.join(missing))
+
+
+def to_number(row, field, cast=float):
+    try:
+        return cast(row[field])
+    except (TypeError, ValueError):
+        raise InvalidRow(f'{field} is not a number')
+
+
+def check_key(value, field):
+    if not value or INVALID_KEY_CHARS & set(value):
+        raise InvalidRow(f'{field} is not a valid database key')
+    return value
+
+
+def food_updates(row, line_number):
+    require(row, 'label', 'prot', 'fat', 'carbs')
+    label = check_key(row['label'].strip(), 'label')
+    food = {
+        'prot': to_number(row, 'prot'),
+        'fat': to_number(row, 'fat'),
+        'carbs': to_number(row, 'carbs')
+    }
+    for field in ('name_en', 'name_id'):
+        if row.get(field):
+            food[field] = row[field]
+    if row.get('aliases'):
+        aliases = row['aliases']
+        food['aliases'] = aliases if isinstance(aliases, list) else [a.strip() for a in aliases.split('|') if a.strip()]
+    return {f'food_nutrients/{label}': food}, None
+
+
+def user_updates(row, line_number):
+    require(row, 'fullname', 'birthday', 'email', 'height', 'weight', 'gender', 'activity_level')
+    email = row['email'].strip()
+    if not is_valid_email(email):
+        raise InvalidRow('email invalid')
+    try:
+        birthday = datetime.date.fromisoformat(row['birthday']).isoformat()
+    except ValueError:
+        raise InvalidRow('birthday is not YYYY-MM-DD')
+    height = to_number(row, 'height', int)
+    weight = to_number(row, 'weight', int)
+    if row['gender'] not in ('M', 'F'):
+        raise InvalidRow('gender must be M or F')
+    if row['activity_level'] not in ('L', 'M', 'H'):
+        raise InvalidRow('activity_level must be L, M or H')
+
+    # Without an explicit user_id the key is derived from the email, so a replay rewrites the same user
+    user_id = row.get('user_id') or hash_email(email)[:20]
+    check_key(user_id, 'user_id')
+    profile = build_user_profile(row['fullname'], birthday, email, height, weight, row['gender'], row['activity_level'])
+    updates = {
+        f'users/{user_id}': {
+            'fullname': row['fullname'],
+            'birthday': birthday,
+            'email': email
+        },
+        f'body_measurements/{user_id}': {
+            'user_id': user_id,
+            'height': height,
+            'weight': weight,
+            'gender': row['gender'],
+            'activity_level': row['activity_level']
+        },
+        f'profiles/{user_id}': profile
+    }
+    return updates, auth.ImportUserRecord(uid=user_id, email=email, display_name=row['fullname'])
+
+
+def meal_updates(row, line_number):
+    require(row, 'user_id', 'title', 'category', 'calories', 'proteins', 'fats', 'carbs', 'timestamp')
+    user_id = check_key(row['user_id'], 'user_id')
+    if row['category'] not in MEAL_CATEGORIES:
+        raise InvalidRow('category must be breakfast, lunch or dinner')
+    try:
+        timestamp = datetime.datetime.fromisoformat(row['timestamp'])
+    except ValueError:
+        raise InvalidRow('timestamp is not ISO 8601')
+
+    foods = row.get('foods') or []
+    if isinstance(foods, str):
+        try:
+            foods = json.loads(foods)
+        except ValueError:
+            raise InvalidRow('foods is not a JSON list')
+    if not isinstance(foods, list):
+        raise InvalidRow('foods is not a list')
+
+    # Stored like store_food_data does, naive UTC; readers treat any timestamp as UTC
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+    entry = {
+        'user_id': user_id,
+        'title': row['title'],
+        'image_url': row.get('image_url'),
+        'category': row['category'],
+        'calories': to_number(row, 'calories'),
+        'proteins': to_number(row, 'proteins'),
+        'fats': to_number(row, 'fats'),
+        'carbs': to_number(row, 'carbs'),
+        'timestamp': timestamp.isoformat()
+    }
+    for index, label_info in enumerate(foods):
+        entry[f'food_{index}'] = label_info
+
+    # Time-ordered key, like push() at the original meal time
+    timestamp_ms = int(timestamp.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+    entry_id = generate_push_id(timestamp_ms, f'meal:{user_id}:{json.dumps(row, sort_keys=True, default=str)}')
+    return {f'user_food/{entry_id}': entry}, None
+
+
+BUILDERS = {
+    'foods': food_updates,
+    'users': user_updates,
+    'meals': meal_updates
+}
+
+
+def load_checkpoint(path, input_path):
+    if not path or not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get('input') != os.path.abspath(input_path):
+        raise SystemExit(f'Checkpoint {path} belongs to {checkpoint.get("input")}')
+    return checkpoint['line']
+
+
+def save_checkpoint(path, input_path, line, written):
+    if not path:
+        return
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'input': os.path.abspath(input_path), 'line': line, 'written': written}, f)
+    os.replace(tmp_path, path)
+
+
+def claim_emails(batch, claim_workers):
+    # Index claims are transactions, run them side by side; False means someone else owns the email
+    with ThreadPoolExecutor(max_workers=claim_workers) as executor:
+        return list(executor.map(lambda item: claim_email_index(item['user'].email, item['user'].uid), batch))
+
+
+def version_bumps(updates, emails, workers=16):
+    # Every user a batch touches gets their version bumped, so cached ETags go stale
+    email_hashes = set()
+    user_ids = set()
+    for path, value in updates.items():
+        if path.startswith('users/'):
+            email_hashes.add(hash_email(value['email']))
+        elif path.startswith('user_food/'):
+            user_ids.add(value['user_id'])
+
+    # Meals only name their user, look up each email once per run
+    unknown = [user_id for user_id in user_ids if user_id not in emails]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for user_id, user in zip(unknown, executor.map(lambda user_id: db.reference('users/' + user_id).get(), unknown)):
+            emails[user_id] = (user or {}).get('email')
+    email_hashes.update(hash_email(emails[user_id]) for user_id in user_ids if emails[user_id])
+
+    return {f'user_versions/{email_hash}': {'.sv': {'increment': 1}} for email_hash in email_hashes}
+
+
+def flush(batch, create_auth, emails, claim_workers=16):
+    # Writes the accepted records of a batch and returns the rejected ones with their error
+    failed = []
+    users = [item for item in batch if item['user'] is not None]
+    if users:
+        for item, claimed in zip(users, claim_emails(users, claim_workers)):
+            if not claimed:
+                item['error'] = 'conflict: email already registered to another user'
+                failed.append(item)
+
+    if create_auth:
+        imported = [item for item in users if 'error' not in item]
+        # import_users takes at most 1000 records per call
+        for start in range(0, len(imported), 1000):
+            chunk = imported[start:start + 1000]
+            result = auth.import_users([item['user'] for item in chunk])
+            for error in result.errors:
+                item = chunk[error.index]
+                item['error'] = f'auth import failed: {error.reason}'
+                release_email_index(item['user'].email, item['user'].uid)
+                failed.append(item)
+
+    updates = {}
+    for item in batch:
+        if 'error' not in item:
+            updates.update(item['updates'])
+    if updates:
+        updates.update(version_bumps(updates, emails, claim_workers))
+        db.reference('/').update(updates)
+    return failed
+
+
+def run(kind, input_path, batch_size, checkpoint_path, rejects_path, create_auth):
+    build = BUILDERS[kind]
+    start_line = load_checkpoint(checkpoint_path, input_path)
+    if start_line:
+        print(f'Resuming after line {start_line}', file=sys.stderr)
+
+    rejects = open(rejects_path, 'a') if rejects_path else None
+    batch = []
+    written = rejected = conflicts = 0
+    emails = {}
+    last_line = start_line
+    started = time.monotonic()
+
+    def reject(line_number, row, error):
+        nonlocal rejected
+        rejected += 1
+        if rejects:
+            rejects.write(json.dumps({'line': line_number, 'error': error, 'row': row}, default=str) + '\n')
+
+    def write_batch():
+        nonlocal written, conflicts
+        failed = flush(batch, create_auth, emails)
+        for item in failed:
+            conflicts += item['error'].startswith('conflict')
+            reject(item['line'], item['row'], item['error'])
+        written += len(batch) - len(failed)
+        # Failed records are in the rejects file, so the checkpoint may move past them
+        save_checkpoint(checkpoint_path, input_path, last_line, written)
+        batch.clear()
+
+    try:
+        for line_number, row, error in read_rows(input_path, start_line):
+            if error is None:
+                try:
+                    row_updates, user_record = build(row, line_number)
+                    batch.append({'line': line_number, 'row': row, 'updates': row_updates, 'user': user_record})
+                except InvalidRow as e:
+                    error = str(e)
+            if error is not None:
+                reject(line_number, row, error)
+            last_line = line_number
+
+            if len(batch) >= batch_size:
+                write_batch()
+                elapsed = time.monotonic() - started
+                print(f'{written} written, {rejected} rejected ({conflicts} email conflicts), '
+                      f'{written / elapsed:.0f} rows/s', file=sys.stderr)
+
+        write_batch()
+    finally:
+        if rejects:
+            rejects.close()
+
+    elapsed = time.monotonic() - started
+    print(f'Done: {written} written, {rejected} rejected ({conflicts} email conflicts) in {elapsed:.1f}s', file=sys.stderr)
+    return rejected == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('kind', choices=sorted(BUILDERS))
+    parser.add_argument('input', help='.csv or .ndjson, optionally .gz compressed')
+    parser.add_argument('--batch-size', type=int, default=1000, help='Records per multi-path update')
+    parser.add_argument('--checkpoint', help='Progress file used to resume an interrupted import')
+    parser.add_argument('--rejects', help='Append rows that fail validation, conflict or fail to import to this NDJSON file')
+    parser.add_argument('--create-auth', action='store_true', help='Also import Firebase Auth accounts (users only)')
+    args = parser.parse_args()
+
+    init_firebase()
+    ok = run(args.kind, args.input, args.batch_size, args.checkpoint, args.rejects, args.create_auth)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
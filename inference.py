@@ -0,0 +1,207 @@
+import logging
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.utils import load_img, img_to_array
+from images import IMAGE_SIZE
+
+DETECTION_THRESHOLD = 0.8
+
+
+def preprocess_image(image, target_size=IMAGE_SIZE):
+    # `image` is a path or a file-like object
+    img = load_img(image, target_size=target_size)
+    x = img_to_array(img)
+    x /= 255
+    return np.expand_dims(x, axis=0)
+
+
+def detect_classes(scores, threshold=DETECTION_THRESHOLD):
+    return np.where(scores > threshold)[0]
+
+
+class TFLiteClassifier:
+    """TFLite model with the same `predict(images, batch_size)` call as Keras.
+
+    An interpreter is not thread safe, so a small pool of them is kept and
+    each call borrows one. Quantized (int8/uint8) inputs and outputs are
+    converted using the tensor's scale and zero point.
+    """
+
+    def __init__(self, model_path=None, model_content=None, pool_size=1, num_threads=None):
+        self._pool = queue.Queue()
+        for _ in range(max(1, pool_size)):
+            interpreter = tf.lite.Interpreter(
+                model_path=model_path,
+                model_content=model_content,
+                num_threads=num_threads
+            )
+            interpreter.allocate_tensors()
+            self._pool.put(interpreter)
+
+        interpreter = self._pool.queue[0]
+        self._input = interpreter.get_input_details()[0]
+        self._output = interpreter.get_output_details()[0]
+
+    def predict(self, images, batch_size=1, verbose=0):
+        interpreter = self._pool.get()
+        try:
+            outputs = []
+            for image in images:
+                interpreter.set_tensor(self._input['index'], self._quantize(image[np.newaxis, ...]))
+                interpreter.invoke()
+                outputs.append(self._dequantize(interpreter.get_tensor(self._output['index'])))
+            return np.vstack(outputs)
+        finally:
+            self._pool.put(interpreter)
+
+    def _quantize(self, x):
+        dtype = self._input['dtype']
+        if dtype == np.float32:
+            return x.astype(np.float32)
+        scale, zero_point = self._input['quantization']
+        info = np.iinfo(dtype)
+        return np.clip(np.round(x / scale + zero_point), info.min, info.max).astype(dtype)
+
+    def _dequantize(self, y):
+        if self._output['dtype'] == np.float32:
+            return y
+        scale, zero_point = self._output['quantization']
+        return (y.astype(np.float32) - zero_point) * scale
+
+
+def load_classifier(path, pool_size=1, model_content=None, num_threads=None):
+    # TFLite interpreters keep their own thread pools, configure_tf_threads only reaches Keras models
+    if model_content is not None:
+        return TFLiteClassifier(model_content=model_content, pool_size=pool_size, num_threads=num_threads)
+    if path.endswith('.tflite'):
+        return TFLiteClassifier(model_path=path, pool_size=pool_size, num_threads=num_threads)
+    return tf.keras.models.load_model(path, compile=False)
+
+
+ActiveModel = namedtuple('ActiveModel', ['model', 'version', 'loaded_at'])
+
+
+class ModelManager:
+    """Owns the serving model and swaps in a new one without a restart.
+
+    A background thread polls the model path for a new version, loads and
+    warms it, then replaces `active` with a single assignment. Handlers
+    read `active` once per request, so in-flight predictions finish on
+    the model they started with and the old one is freed afterwards.
+
+    The version is the content of `<path>.version` when that file exists
+    (write it after the model file is in place), otherwise the model
+    file's mtime and size.
+
+    `preload()` is the fork-safe part and can run in the gunicorn master;
+    `start()` creates TF objects and threads and must run in each worker.
+    """
+
+    def __init__(self, path, pool_size=1, poll_interval=30, num_threads=None):
+        self.path = path
+        self.pool_size = pool_size
+        self.num_threads = num_threads
+        self.poll_interval = poll_interval
+        self.active = None
+        self.reloads = 0
+        self.reload_failures = 0
+        self._reload_lock = threading.Lock()
+        self._poller = None
+        self._preloaded = None
+
+    def preload(self):
+        # Read a .tflite file without touching the TF runtime, so forked workers
+        # build their interpreters on one copy-on-write shared buffer. Keras
+        # models cannot be loaded before fork and are loaded per worker.
+        if self.path.endswith('.tflite'):
+            version = self.current_version()
+            with open(self.path, 'rb') as f:
+                self._preloaded = (version, f.read())
+
+    def load(self):
+        version = self.current_version()
+        model_content = None
+        if self._preloaded is not None and self._preloaded[0] == version:
+            model_content = self._preloaded[1]
+        else:
+            self._preloaded = None
+        model = load_classifier(self.path, pool_size=self.pool_size, model_content=model_content,
+                                num_threads=self.num_threads)
+        warm_up(model)
+        self.active = ActiveModel(model, version, time.time())
+        return self.active
+
+    def current_version(self):
+        version_file = self.path + '.version'
+        if os.path.exists(version_file):
+            with open(version_file) as f:
+                return f.read().strip()
+        stat = os.stat(self.path)
+        return f'{int(stat.st_mtime)}-{stat.st_size}'
+
+    def reload_if_changed(self):
+        # Only one reload at a time; a second caller just skips
+        if not self._reload_lock.acquire(blocking=False):
+            return False
+        try:
+            version = self.current_version()
+            if self.active is not None and version == self.active.version:
+                return False
+            self.load()
+            self.reloads += 1
+            logging.info('Model reloaded: %s (version %s)', self.path, self.active.version)
+            return True
+        except Exception:
+            self.reload_failures += 1
+            logging.exception('Model reload failed, keeping version %s', self.active.version if self.active else None)
+            return False
+        finally:
+            self._reload_lock.release()
+
+    def start(self):
+        if self.active is None:
+            self.load()
+        if self.poll_interval <= 0 or (self._poller is not None and self._poller.is_alive()):
+            return
+        self._poller = threading.Thread(target=self._poll, name='model-reload', daemon=True)
+        self._poller.start()
+
+    def _poll(self):
+        while True:
+            time.sleep(self.poll_interval)
+            self.reload_if_changed()
+
+    def stats(self):
+        active = self.active
+        return {
+            'path': self.path,
+            'version': active.version if active else None,
+            'loaded_at': active.loaded_at if active else None,
+            'reloads': self.reloads,
+            'reload_failures': self.reload_failures
+        }
+
+
+def warm_up(model):
+    # First predict builds kernels and allocates buffers, keep it off the request path
+    model.predict(np.zeros((1,) + IMAGE_SIZE + (3,), dtype=np.float32), batch_size=1)
+
+
+def configure_tf_threads(intra_op, inter_op):
+    # Only takes effect before the TF runtime starts, i.e. before the first model is loaded
+    if intra_op:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op)
+    if inter_op:
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op)
+
+
+def get_rss_mb():
+    # Current resident set size of this process
+    with open('/proc/self/statm') as f:
+        resident_pages = int(f.read().split()[1])
+    return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
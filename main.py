@@ -1,38 +1,125 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request, stream_with_context
 from flask_cors import CORS
-import firebase_admin
-from firebase_admin import credentials, db, auth, storage
-import tensorflow as tf
+from firebase_admin import db, auth, storage
 from config import *
 from utils import *
-import numpy as np
-from tensorflow.keras.utils import load_img, img_to_array
-from tensorflow.keras.models import load_model
-from PIL import Image
+from admission import AdmissionRejected, create_inference_controller
+from inference import ModelManager, configure_tf_threads, detect_classes, preprocess_image
+from profiling import init_profiling
+from responses import init_responses
+import deadline
+from deadline import DEADLINE_ERRORS, init_deadlines
+from food_search import FoodIndex
+from meal_archive import iter_user_food
+from meal_export import CONTENT_TYPES, ExportProgress, encode_chunks, error_trailer, format_rows
+from runtime_config import get_runtime_config
+from images import ImageQualityGate
 import datetime
+import hashlib
 import io
+import logging
+import re
+import threading
+import time
+import uuid
 import requests
+from concurrent.futures import ThreadPoolExecutor
 import jwt
 import bcrypt
 
-# Initialize Firebase
-cred = credentials.Certificate('serviceAccountKey1.json')
-firebase_admin.initialize_app(cred, {
-    'databaseURL': 'https://capstone-project-nutrimatch-default-rtdb.asia-southeast1.firebasedatabase.app/',
-    'storageBucket': 'capstone-project-nutrimatch.appspot.com'
-})
-
 # Initialize Flask
 app = Flask(__name__)
 CORS(app)
 
+# Workers, threads and TF thread pools sized from the container's limits
+runtime = get_runtime_config()
+
+# Per-worker setup. With gunicorn --preload this module is imported once in
+# the master and forked, so anything that opens connections, starts threads
+# or initializes the TF runtime waits until start_worker() runs in the worker
+# (gunicorn.conf.py post_worker_init, or the first request otherwise).
+worker_lock = threading.Lock()
+worker_started = False
+
+def start_worker():
+    global worker_started
+    with worker_lock:
+        if worker_started:
+            return
+        # Initialize Firebase
+        init_firebase()
+        configure_tf_threads(runtime.tf_intra_op_threads, runtime.tf_inter_op_threads)
+        model_manager.start()
+        food_index.watch()
+        worker_started = True
+
+@app.before_request
+def ensure_worker_started():
+    if not worker_started:
+        start_worker()
+
+@app.teardown_request
+def release_inference_reservation(exc):
+    # Frees the place of a scan that failed before reaching its slot
+    reservation = g.pop('inference_reservation', None)
+    if reservation is not None:
+        reservation.release()
+
+# Opt-in per-request profiling, registers nothing when disabled
+init_profiling(
+    app,
+    output_dir=get_config('PROFILE_DIR', '/tmp/profiles'),
+    sample_rate=get_config('PROFILE_SAMPLE_RATE', 0.0),
+    secret=get_config('PROFILE_SECRET', ''),
+    mode=get_config('PROFILE_MODE', 'cprofile')
+)
+
+# orjson for jsonify, brotli/gzip for bodies above the threshold
+init_responses(
+    app,
+    min_size=get_config('COMPRESSION_MIN_SIZE', 1024),
+    gzip_level=get_config('GZIP_LEVEL', 6),
+    brotli_quality=get_config('BROTLI_QUALITY', 4)
+)
+
+# Every request gets a time budget, backend calls get what is left of it (504 once spent)
+init_deadlines(app, get_config('REQUEST_TIMEOUT', 15.0), get_config('ROUTE_TIMEOUTS', {}))
+
 @app.get("/")
 def hello():
     """Return a friendly HTTP greeting."""
     who = request.args.get("who", default="World")
     return f"Hello {who}!\n"
 
+# METRICS
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    response = {
+        'status': True,
+        'message': 'Success get metrics',
+        'data': {
+            'inference': inference_admission.stats(),
+            'model': model_manager.stats(),
+            'image_gate': image_gate.stats(),
+            'runtime': runtime._asdict()
+        }
+    }
+    return jsonify(response), 200
+
+# 429/503: Shed load
+@app.errorhandler(AdmissionRejected)
+def handle_admission_rejected(e):
+    response = {
+        'status': False,
+        'message': e.message,
+        'data': None
+    }
+    return jsonify(response), e.status_code, {'Retry-After': str(e.retry_after)}
+
 # ------------ AUTH --------------
+# Auth calls overlapped with database writes
+auth_executor = ThreadPoolExecutor(max_workers=runtime.threads, thread_name_prefix='auth')
+
 # REGISTER
 @app.route('/auth/register', methods=['POST'])
 def register():
@@ -56,32 +143,37 @@ def register():
 
     # 201: Registration
     try:
-        # Create authentication 
-        user = auth.create_user(email=email, password=password)
-        
-        # Add user's data to Realtime Database
-        users_ref = db.reference('users')
-        new_user_ref = users_ref.push()
-        new_user_ref.set({
-            'fullname': fullname,
-            'birthday': birthday,
-            'email': email
-        })
+        # One id for the Auth user and every database record, generated here so
+        # the Auth call and the database writes can run at the same time
+        user_id = generate_push_id(int(time.time() * 1000), uuid.uuid4().hex)
+        creation = auth_executor.submit(auth.create_user, uid=user_id, email=email, password=password)
+
+        claimed = False
+        written = False
+        try:
+            # 401: Email already indexed for another user
+            claimed = claim_email_index(email, user_id)
+            if not claimed:
+                raise auth.EmailAlreadyExistsError('Email already registered', None, None)
+
+            # User, body measurement, profile with precomputed targets and the version bump in one write
+            create_user_records(user_id, build_user_profile(fullname, birthday, email, height, weight, gender, activity_level))
+            written = True
+
+            # Raises EmailAlreadyExistsError when Auth already has the email
+            creation.result(timeout=deadline.remaining())
+        except Exception:
+            # Undo whatever got written; the Auth user is deleted once its creation finishes
+            if written:
+                delete_user_records(user_id)
+            if claimed:
+                release_email_index(email, user_id)
+            creation.add_done_callback(discard_created_user)
+            raise
 
         # Generate access token
         access_token = create_access_token_with_claims(email, secret_key)
 
-        # Store body measurement data
-        body_measurement_ref = db.reference('body_measurements')
-        new_measurement_ref = body_measurement_ref.push()
-        new_measurement_ref.set({
-            'user_id': new_user_ref.key,
-            'height': height,
-            'weight': weight,
-            'gender': gender,
-            'activity_level': activity_level
-        })
-
         response = {
             'status': True,
             'message': 'Register success!',
@@ -89,7 +181,6 @@ def register():
                 'token': access_token
             }
         }
-
         return jsonify(response), 201
     
     # 401: Email already registered
@@ -116,8 +207,7 @@ def check_email():
         return jsonify(response), 400
 
     # 409 : Email already registered
-    try:
-        user = auth.get_user_by_email(email)
+    if get_user_id_by_email(email) is not None:
         response = {
             'status': False,
             'message': 'Email already registered!',
@@ -126,7 +216,7 @@ def check_email():
         return jsonify(response), 409
 
     # 200: Email can be registered!
-    except auth.UserNotFoundError:
+    else:
         response = {
             'status': True,
             'message': 'Email can be registered!',
@@ -166,34 +256,36 @@ def login():
         'returnSecureToken': True
     }
 
-    response = requests.post(FIREBASE_AUTH_API, json=payload)
+    response = requests.post(FIREBASE_AUTH_API, json=payload, timeout=deadline.remaining(BACKEND_TIMEOUT))
     data = response.json()
 
     if response.status_code == 200:
-        user = auth.get_user_by_email(email)
-        user_id = user.uid
-        access_token = create_access_token_with_claims(email, secret_key)
+        # Database key from the email index, older accounts are not keyed by their Auth uid
+        user_id = get_user_id_by_email(email)
 
-        # Get user data from Realtime Database
-        users_ref = db.reference('users')
-        user_data = users_ref.order_by_child('email').equal_to(email).get()
+        # 404: Signed in but no user record
+        if user_id is None:
+            response = {
+                'status': False,
+                'message': 'User not found in the database',
+                'data': None
+            }
+            return jsonify(response), 404
 
-        # Get body measurement data
-        body_measurement_ref = db.reference('body_measurements')
-        query = body_measurement_ref.order_by_child('user_id').equal_to(list(user_data.keys())[0]).get()
-
-        user_response = {
-            'id': user_id,
-            'fullname': user_data[list(user_data.keys())[0]]['fullname'],
-            'email': email,
-            'birthday': user_data[list(user_data.keys())[0]]['birthday'],
-            'body_measurement': {
-                'height': query[list(query.keys())[0]]['height'],
-                'weight': query[list(query.keys())[0]]['weight'],
-                'activity_level': query[list(query.keys())[0]]['activity_level'],
-                'gender': query[list(query.keys())[0]]['gender']
+        access_token = create_access_token_with_claims(email, secret_key)
+
+        # Get profile (user data and body measurement)
+        profile = get_user_profile(user_id)
+        # 404: No profile for this user
+        if profile is None:
+            response = {
+                'status': False,
+                'message': 'User profile not found',
+                'data': None
             }
-        }
+            return jsonify(response), 404
+
+        user_response = profile_response(user_id, profile)
 
         response = {
             'status': True,
@@ -237,13 +329,21 @@ def update_account_settings():
         payload = jwt.decode(access_token, secret_key, algorithms=['HS256'])
         user_email = payload['sub']
 
-        # Get user data from Realtime Database
-        users_ref = db.reference('users')
-        user_data = users_ref.order_by_child('email').equal_to(user_email).get()
+        # Get user id from the email index
+        user_id = get_user_id_by_email(user_email)
+
+        # 404: User not found
+        if user_id is None:
+            response = {
+                'status': False,
+                'message': 'User not found in the database',
+                'data': None
+            }
+            return jsonify(response), 404
 
         # Get body measurement data
         body_measurement_ref = db.reference('body_measurements')
-        query = body_measurement_ref.order_by_child('user_id').equal_to(list(user_data.keys())[0]).get()
+        query = query_equal_to('body_measurements', 'user_id', user_id)
         measurement_id = list(query.keys())[0]
 
         # Request
@@ -270,6 +370,15 @@ def update_account_settings():
             'gender': gender,
             'activity_level': activity_level
         })
+        reads.forget(f'body_measurements?user_id={user_id}')
+        update_user_profile(user_id, body_measurement={
+            'height': height,
+            'weight': weight,
+            'activity_level': activity_level,
+            'gender': gender
+        })
+        bump_user_version(user_email)
+
         response = {
             'status': True,
             'message': 'Settings body\'s measurements success!',
@@ -293,6 +402,10 @@ def update_account_settings():
         }
         return jsonify(response), 401
 
+    # 504: handled by init_deadlines
+    except DEADLINE_ERRORS:
+        raise
+
     except Exception as e:
         response = {
             'status': False,
@@ -321,36 +434,117 @@ def get_profile():
         payload = jwt.decode(access_token, secret_key, algorithms=['HS256'])
         user_email = payload['sub']
 
-        # Get user data from Realtime Database
-        users_ref = db.reference('users')
-        user_data = users_ref.order_by_child('email').equal_to(user_email).get()
+        # 304: Not modified
+        etag = make_etag('profile', user_email, get_user_version(user_email))
+        if etag_matches(etag):
+            return not_modified(etag)
 
-        user_id = list(user_data.keys())[0]
+        # Get user id from the email index
+        user_id = get_user_id_by_email(user_email)
 
-        # Get body measurement data
-        body_measurement_ref = db.reference('body_measurements')
-        query = body_measurement_ref.order_by_child('user_id').equal_to(user_id).get()
-        measurement_id = list(query.keys())[0]
+        # 404: User not found
+        if user_id is None:
+            response = {
+                'status': False,
+                'message': 'User not found in the database',
+                'data': None
+            }
+            return jsonify(response), 404
 
-        # 200: Success
-        user_response = {
-            'id': user_id,
-            'fullname': user_data[user_id]['fullname'],
-            'email': user_email,
-            'birthday': user_data[user_id]['birthday'],
-            'body_measurement': {
-                'height': query[measurement_id]['height'],
-                'weight': query[measurement_id]['weight'],
-                'activity_level': query[measurement_id]['activity_level'],
-                'gender': query[measurement_id]['gender']
+        # Get profile (user data and body measurement)
+        profile = get_user_profile(user_id)
+        # 404: No profile for this user
+        if profile is None:
+            response = {
+                'status': False,
+                'message': 'User profile not found',
+                'data': None
             }
-        }
+            return jsonify(response), 404
+
+        # 200: Success
+        user_response = profile_response(user_id, profile)
         response = {
             'status': True,
             'message': 'Success get profile data',
             'data': user_response
         }
-        return jsonify(response), 200
+        return with_etag(jsonify(response), etag), 200
+
+    except jwt.exceptions.InvalidTokenError:
+        response = {
+            'status': False,
+            'message': 'Invalid token, please re-login',
+            'data': None
+        }
+        return jsonify(response), 401
+
+# EXPORT
+@app.route('/profile/export', methods=['GET'])
+def export_meals():
+    auth_header = request.headers.get('Authorization')
+    # 401: Invalid token
+    if not auth_header or not auth_header.startswith('Bearer '):
+        response = {
+            'status': False,
+            'message': 'Invalid token, please re-login',
+            'data': None
+        }
+        return jsonify(response), 401
+
+    access_token = auth_header.split(' ')[1]
+
+    try:
+        payload = jwt.decode(access_token, secret_key, algorithms=['HS256'])
+        user_email = payload['sub']
+
+        # 400: Unknown format
+        export_format = request.args.get('format', 'ndjson')
+        if export_format not in CONTENT_TYPES:
+            response = {
+                'status': False,
+                'message': 'Format must be ndjson or csv',
+                'data': None
+            }
+            return jsonify(response), 400
+        compress = request.args.get('gzip') in ('1', 'true')
+
+        # Get user id from the email index
+        user_id = get_user_id_by_email(user_email)
+        if user_id is None:
+            response = {
+                'status': False,
+                'message': 'User not found in the database',
+                'data': None
+            }
+            return jsonify(response), 404
+
+        progress = ExportProgress(iter_user_food(user_id))
+
+        def rows():
+            # Headers are already sent, so a failure is reported in the body itself
+            try:
+                yield from format_rows(progress, export_format)
+            except Exception:
+                logging.exception('Export for user %s failed after %s', user_id, progress.summary())
+                trailer = error_trailer(export_format, f'stopped after {progress.rows} rows')
+                if trailer is None:
+                    # Abort the chunked response so the client sees a truncated download
+                    raise
+                yield trailer
+                return
+            logging.info('Export for user %s: %s', user_id, progress.summary())
+
+        def generate():
+            # The request deadline covers the route up to the first byte; a long
+            # download then only waits on each backend read's own timeout
+            g.pop('deadline', None)
+            yield from encode_chunks(rows(), compress)
+
+        file_name = f'meals.{export_format}' + ('.gz' if compress else '')
+        headers = {'Content-Disposition': f'attachment; filename="{file_name}"'}
+        mimetype = 'application/gzip' if compress else CONTENT_TYPES[export_format]
+        return Response(stream_with_context(generate()), mimetype=mimetype, headers=headers)
 
     except jwt.exceptions.InvalidTokenError:
         response = {
@@ -383,10 +577,11 @@ def update_account():
 
         # Get user data from Realtime Database
         users_ref = db.reference('users')
-        user_data = users_ref.order_by_child('email').equal_to(user_email).get()
+        user_id = get_user_id_by_email(user_email)
+        profile = get_user_profile(user_id) if user_id else None
 
         # 404: User not found
-        if not user_data:
+        if not profile:
             response = {
                 'status': False,
                 'message': 'User not found!',
@@ -394,8 +589,6 @@ def update_account():
             }
             return jsonify(response), 404
 
-        user_id = list(user_data.keys())[0]
-
         # Update user's fullname and birthday
         fullname = request.form.get('fullname')
         birthday = request.form.get('birthday')
@@ -409,7 +602,7 @@ def update_account():
             return jsonify(response), 400
 
         # 403: Forbidden
-        if user_email != user_data[user_id]['email']:
+        if user_email != profile['email']:
             response = {
                 'status': False,
                 'message': 'Forbidden',
@@ -423,6 +616,10 @@ def update_account():
             'fullname': fullname,
             'birthday': birthday
         })
+        reads.forget('users/' + user_id)
+        update_user_profile(user_id, fullname=fullname, birthday=birthday, profile=profile)
+        bump_user_version(user_email)
+
         response = {
             'status': True,
             'message': 'Edit success!',
@@ -515,6 +712,10 @@ def change_password():
         }
         return jsonify(response), 401
 
+    # 504: handled by init_deadlines
+    except DEADLINE_ERRORS:
+        raise
+
     except Exception as e:
         response = {
             'status': False,
@@ -525,11 +726,62 @@ def change_password():
 
 
 # ------------ MASTER --------------
-model = tf.keras.models.load_model('model.h5', compile=False)
+# MODEL_PATH may point at a quantized .tflite built by quantize_model.py
+model_manager = ModelManager(
+    get_config('MODEL_PATH', 'model.h5'),
+    pool_size=runtime.inference_concurrency,
+    poll_interval=get_config('MODEL_POLL_INTERVAL', 30),
+    num_threads=runtime.tf_intra_op_threads
+)
+# Fork-safe part of model loading, shared copy-on-write by preforked workers
+model_manager.preload()
+
+# Inference admission control
+inference_admission = create_inference_controller(
+    web_threads=runtime.threads,
+    concurrency=runtime.inference_concurrency,
+    queue_size=get_config('INFERENCE_QUEUE_SIZE', 4),
+    max_wait=get_config('INFERENCE_QUEUE_TIMEOUT', 5.0),
+    reserved_threads=get_config('INFERENCE_RESERVED_THREADS', 2)
+)
+
+# Food catalog search index, kept in sync with food_nutrients by a listener
+food_index = FoodIndex('food_nutrients')
+
+# Cheap checks that turn away unusable photos before decode and inference
+image_gate = ImageQualityGate(
+    min_side=get_config('IMAGE_MIN_SIDE', 64),
+    dark_threshold=get_config('IMAGE_DARK_THRESHOLD', 20),
+    bright_threshold=get_config('IMAGE_BRIGHT_THRESHOLD', 235),
+    blur_threshold=get_config('IMAGE_BLUR_THRESHOLD', 40)
+)
+
+IMAGE_REJECTION_MESSAGES = {
+    'invalid': 'Invalid image file',
+    'too_small': 'Image resolution is too low',
+    'too_dark': 'Image is too dark',
+    'too_bright': 'Image is too bright',
+    'blurry': 'Image is too blurry'
+}
+
+def image_rejected_response(reason):
+    # 422: Not worth running the model on
+    response = {
+        'status': False,
+        'message': IMAGE_REJECTION_MESSAGES[reason],
+        'data': {'reason': reason}
+    }
+    return jsonify(response), 422
+
+# Background uploads overlapping with inference (threads start on first use, fork-safe)
+upload_executor = ThreadPoolExecutor(max_workers=runtime.threads, thread_name_prefix='upload')
 
 # SCAN NUTRITION
 @app.route('/master/scan_nutrition', methods=['POST'])
 def scan_nutrition():
+    # 429: Shed before the token, index read and multipart upload are paid for
+    g.inference_reservation = inference_admission.reserve()
+
     # Get the user's access token from the request headers
     auth_header = request.headers.get('Authorization')
     if not auth_header or not auth_header.startswith('Bearer '):
@@ -547,14 +799,8 @@ def scan_nutrition():
         payload = jwt.decode(access_token, secret_key, algorithms=['HS256'])
         user_email = payload['sub']
 
-        # Get user data from Realtime Database
-        users_ref = db.reference('users')
-        user_query = users_ref.order_by_child('email').equal_to(user_email).get()
-
-        user_id = None
-        for key in user_query:
-            user_id = key
-            break
+        # Get user id from the email index
+        user_id = get_user_id_by_email(user_email)
 
         if user_id is None:
             response = {
@@ -567,19 +813,27 @@ def scan_nutrition():
         food_image = request.files['food_image']
         food_weight = float(request.form['food_weight'])
 
-        # Load Image
-        img = load_img(io.BytesIO(food_image.read()), target_size=(416, 416))
-        x = img_to_array(img)
-        x /= 255
-        x = np.expand_dims(x, axis=0)
-        images = np.vstack([x])
+        image_data = food_image.read()
+
+        # Skip the model for images it cannot classify
+        rejection = image_gate.check(image_data)
+        if rejection is not None:
+            return image_rejected_response(rejection)
+
+        # Pin the model for this request, a hot reload must not swap it mid-way
+        active_model = model_manager.active
 
-        # ML detection
-        classes = model.predict(images, batch_size=1)
+        # Wait for an inference slot (429/503 when overloaded), no longer than the request has left
+        with inference_admission.slot(max_wait=deadline.remaining(), reservation=g.inference_reservation):
+            # Load Image
+            images = preprocess_image(io.BytesIO(image_data))
+
+            # ML detection
+            classes = active_model.model.predict(images, batch_size=1)
+        deadline.check()
 
         # Detection Confidence
-        threshold = 0.8
-        class_indices = np.where(classes[0] > threshold)[0]
+        class_indices = detect_classes(classes[0])
 
         # Get Detected Label
         class_labels = get_class_labels(class_indices)
@@ -592,33 +846,232 @@ def scan_nutrition():
                 'message': 'Failed to scan food',
                 'data': []
             }
-            return jsonify(response), 401
+            return jsonify(response), 401, {'X-Model-Version': active_model.version}
 
         # Calculate nutrition for each label
-        foods = []
-        for label in class_labels:
-            nutrition = get_nutrition_info(label)
-            weight = round(food_weight / len(class_labels), 2)
+        foods = get_foods_nutrition(class_labels, food_weight)
 
-            protein = round(nutrition['prot'] * weight, 2)
-            fat = round(nutrition['fat'] * weight, 2)
-            carb = round(nutrition['carbs'] * weight, 2)
+        # 200: Success
+        response = {
+            'status': True,
+            'message': 'Food Successfully Scanned!',
+            'data': foods
+        }
+        return jsonify(response), 200, {'X-Model-Version': active_model.version}
 
-            label_info = {
-                'food_title': label,
-                'nutrition_info': {
-                    'weight': weight,
-                    'protein': protein,
-                    'fat': fat,
-                    'carb': carb
+    except jwt.ExpiredSignatureError:
+        response = {
+            'status': False,
+            'message': 'Expired access token!',
+            'data': None
+        }
+        return jsonify(response), 401
+
+    except jwt.InvalidTokenError:
+        response = {
+            'status': False,
+            'message': 'Invalid access token!',
+            'data': None
+        }
+        return jsonify(response), 401
+
+# SCAN AND SUBMIT
+@app.route('/master/scan_and_submit', methods=['POST'])
+def scan_and_submit():
+    # 429: Shed before the token, index read and multipart upload are paid for
+    g.inference_reservation = inference_admission.reserve()
+
+    # Get the user's access token from the request headers
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        response = {
+            'status': False,
+            'message': 'Invalid access token!',
+            'data': None
+        }
+        return jsonify(response), 401
+
+    access_token = auth_header.split(' ')[1]
+
+    try:
+        # Verify the access token
+        payload = jwt.decode(access_token, secret_key, algorithms=['HS256'])
+        user_email = payload['sub']
+
+        # Get user id from the email index
+        user_id = get_user_id_by_email(user_email)
+
+        if user_id is None:
+            response = {
+                'status': False,
+                'message': 'User not found in the database',
+                'data': None
+            }
+            return jsonify(response), 404
+
+        food_image = request.files['food_image']
+        food_weight = float(request.form['food_weight'])
+
+        # Read the upload once, both the storage upload and the model use this buffer
+        image_data = food_image.read()
+
+        # Skip the model, and the upload, for images it cannot classify
+        rejection = image_gate.check(image_data)
+        if rejection is not None:
+            return image_rejected_response(rejection)
+
+        # Content-addressed per user, never a client-chosen name another meal may point at
+        upload_ref = image_ref_for(user_id, hashlib.sha256(image_data).hexdigest(), IMAGE_CONTENT_TYPES.get(food_image.content_type, 'jpg'))
+        upload = upload_executor.submit(upload_food_image_data, image_data, upload_ref, food_image.content_type, deadline.remaining())
+
+        # Pin the model for this request, a hot reload must not swap it mid-way
+        active_model = model_manager.active
+
+        try:
+            # Wait for an inference slot (429/503 when overloaded), no longer than the request has left
+            with inference_admission.slot(max_wait=deadline.remaining(), reservation=g.inference_reservation):
+                images = preprocess_image(io.BytesIO(image_data))
+                classes = active_model.model.predict(images, batch_size=1)
+            deadline.check()
+
+            # Get Detected Label
+            class_labels = get_class_labels(detect_classes(classes[0]))
+
+            # 401: Failed to scan
+            if len(class_labels) == 0:
+                upload.add_done_callback(lambda future: discard_uploaded_image(future, user_id))
+                response = {
+                    'status': False,
+                    'message': 'Failed to scan food',
+                    'data': []
                 }
+                return jsonify(response), 401, {'X-Model-Version': active_model.version}
+
+            # Calculate nutrition for each label
+            foods = get_foods_nutrition(class_labels, food_weight)
+
+            # Convert to the submit_food format and total it up
+            stored_foods = []
+            total_calories = 0
+            total_protein = 0
+            total_fat = 0
+            total_carb = 0
+
+            for food in foods:
+                nutrition_info = food['nutrition_info']
+                stored_foods.append({
+                    'name': food['food_title'],
+                    'weight': nutrition_info['weight'],
+                    'protein': nutrition_info['protein'],
+                    'fat': nutrition_info['fat'],
+                    'carb': nutrition_info['carb']
+                })
+                total_calories += (nutrition_info['protein'] * 4) + (nutrition_info['carb'] * 4) + (nutrition_info['fat'] * 9)
+                total_protein += nutrition_info['protein']
+                total_fat += nutrition_info['fat']
+                total_carb += nutrition_info['carb']
+
+            meal_category = categorize_meal()
+            food_title = ', '.join(class_labels)
+
+            # Wait for the upload started before inference
+            blob, _ = upload.result(timeout=deadline.remaining())
+
+            # Store data to Realtime Database
+            entry_id = store_food_data(user_id, blob.public_url, meal_category, total_calories, total_protein, total_fat, total_carb, stored_foods, food_title)
+        except Exception:
+            # Nothing will reference the uploaded image
+            upload.add_done_callback(lambda future: discard_uploaded_image(future, user_id))
+            raise
+
+        bump_user_version(user_email)
+
+        # 200: Success
+        response = {
+            'status': True,
+            'message': 'Food Successfully Scanned and Submitted!',
+            'data': {
+                'entry_id': entry_id,
+                'foods': foods
             }
-            foods.append(label_info)
+        }
+        return jsonify(response), 200, {'X-Model-Version': active_model.version}
+
+    except jwt.ExpiredSignatureError:
+        response = {
+            'status': False,
+            'message': 'Expired access token!',
+            'data': None
+        }
+        return jsonify(response), 401
+
+    except jwt.InvalidTokenError:
+        response = {
+            'status': False,
+            'message': 'Invalid access token!',
+            'data': None
+        }
+        return jsonify(response), 401
+
+    # 400: Bad Request
+    except KeyError:
+        response = {
+            'status': False,
+            'message': 'Failed to submit!',
+            'data': None
+        }
+        return jsonify(response), 400
+
+# FOOD SEARCH
+@app.route('/master/foods/search', methods=['GET'])
+def search_foods():
+    # Get the user's access token from the request headers
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        response = {
+            'status': False,
+            'message': 'Invalid access token!',
+            'data': None
+        }
+        return jsonify(response), 401
+
+    access_token = auth_header.split(' ')[1]
+
+    try:
+        # Verify the access token, served from memory without a database read
+        jwt.decode(access_token, secret_key, algorithms=['HS256'])
+
+        query = request.args.get('q', '')
+        limit = min(request.args.get('limit', default=10, type=int), 50)
+
+        # 503: Index still loading
+        if not food_index.ready:
+            response = {
+                'status': False,
+                'message': 'Food search is not ready yet',
+                'data': None
+            }
+            return jsonify(response), 503, {'Retry-After': '1'}
+
+        foods = []
+        for result in food_index.search(query, limit):
+            food = result['food']
+            foods.append({
+                'food_title': result['label'],
+                'name_id': food.get('name_id'),
+                'name_en': food.get('name_en'),
+                'aliases': food.get('aliases', []),
+                'nutrition_per_gram': {
+                    'protein': food.get('prot'),
+                    'fat': food.get('fat'),
+                    'carb': food.get('carbs')
+                }
+            })
 
         # 200: Success
         response = {
             'status': True,
-            'message': 'Food Successfully Scanned!',
+            'message': 'Success search foods',
             'data': foods
         }
         return jsonify(response), 200
@@ -639,6 +1092,99 @@ def scan_nutrition():
         }
         return jsonify(response), 401
 
+# UPLOAD URL
+@app.route('/master/upload_url', methods=['POST'])
+def create_upload_url():
+    # Get the user's access token from the request headers
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        response = {
+            'status': False,
+            'message': 'Invalid access token!',
+            'data': None
+        }
+        return jsonify(response), 401
+
+    access_token = auth_header.split(' ')[1]
+
+    try:
+        # Verify the access token
+        payload = jwt.decode(access_token, secret_key, algorithms=['HS256'])
+        user_email = payload['sub']
+
+        # Get user id from the email index
+        user_id = get_user_id_by_email(user_email)
+
+        if user_id is None:
+            response = {
+                'status': False,
+                'message': 'User not found in the database',
+                'data': None
+            }
+            return jsonify(response), 404
+
+        # Request
+        sha256 = request.form.get('sha256', '').lower()
+        content_type = request.form.get('content_type', '')
+        md5 = request.form.get('md5')
+
+        # 400: Bad Request
+        if not re.match(r'^[0-9a-f]{64}$', sha256) or content_type not in IMAGE_CONTENT_TYPES:
+            response = {
+                'status': False,
+                'message': 'Invalid image hash or content type!',
+                'data': None
+            }
+            return jsonify(response), 400
+
+        expires_in = get_config('UPLOAD_URL_EXPIRATION', 300)
+        image_ref, upload_url = create_image_upload_url(user_id, sha256, content_type, md5, expires_in)
+
+        # 200: Already uploaded, submit with the image_ref straight away
+        if upload_url is None:
+            response = {
+                'status': True,
+                'message': 'Image already uploaded!',
+                'data': {
+                    'image_ref': image_ref,
+                    'upload_url': None
+                }
+            }
+            return jsonify(response), 200
+
+        # 200: Success
+        headers = dict(UPLOAD_PRECONDITION_HEADERS, **{'Content-Type': content_type})
+        if md5:
+            headers['Content-MD5'] = md5
+        response = {
+            'status': True,
+            'message': 'Upload URL created!',
+            'data': {
+                'image_ref': image_ref,
+                'upload_url': upload_url,
+                'method': 'PUT',
+                'headers': headers,
+                'expires_in': expires_in
+            }
+        }
+        return jsonify(response), 200
+
+    except jwt.ExpiredSignatureError:
+        response = {
+            'status': False,
+            'message': 'Expired access token!',
+            'data': None
+        }
+        return jsonify(response), 401
+
+    except jwt.InvalidTokenError:
+        response = {
+            'status': False,
+            'message': 'Invalid access token!',
+            'data': None
+        }
+        return jsonify(response), 401
+
 # SUMBIT MANUAL
 @app.route('/master/submit_manual', methods=['POST'])
 def submit_manual():
@@ -659,14 +1205,8 @@ def submit_manual():
         payload = jwt.decode(access_token, secret_key, algorithms=['HS256'])
         user_email = payload['sub']
 
-        # Get user data from Realtime Database
-        users_ref = db.reference('users')
-        user_query = users_ref.order_by_child('email').equal_to(user_email).get()
-
-        user_id = None
-        for key in user_query:
-            user_id = key
-            break
+        # Get user id from the email index
+        user_id = get_user_id_by_email(user_email)
 
         if user_id is None:
             response = {
@@ -677,7 +1217,9 @@ def submit_manual():
             return jsonify(response), 404
 
         # Request
-        food_image = request.files['food_image']
+        # Image: a reference from /master/upload_url, or the file itself
+        image_ref = request.form.get('image_ref')
+        food_image = None if image_ref else request.files['food_image']
         name = request.form['name']
         weight = request.form['weight']
         calories = request.form['calories']
@@ -724,10 +1266,23 @@ def submit_manual():
         food_title = name
 
         # Upload and retrieve image URL
-        image_url = upload_food_image(food_image)
+        if image_ref:
+            image_url = get_uploaded_image_url(image_ref, user_id)
+
+            # 400: Image not uploaded
+            if image_url is None:
+                response = {
+                    'status': False,
+                    'message': 'Image not uploaded!',
+                    'data': None
+                }
+                return jsonify(response), 400
+        else:
+            image_url = upload_food_image(food_image)
 
         # Store data to Realtime Database
         store_food_data(user_id, image_url, meal_category, calories, proteins, fats, carbs, foods, food_title)
+        bump_user_version(user_email)
 
         # 200: Success
         response = {
@@ -766,14 +1321,8 @@ def submit_food():
         payload = jwt.decode(access_token, secret_key, algorithms=['HS256'])
         user_email = payload['sub']
 
-        # Get user data from Realtime Database
-        users_ref = db.reference('users')
-        user_query = users_ref.order_by_child('email').equal_to(user_email).get()
-
-        user_id = None
-        for key in user_query:
-            user_id = key
-            break
+        # Get user id from the email index
+        user_id = get_user_id_by_email(user_email)
 
         if user_id is None:
             response = {
@@ -784,7 +1333,9 @@ def submit_food():
             return jsonify(response), 404
     
         # Request
-        food_image = request.files['food_image']
+        # Image: a reference from /master/upload_url, or the file itself
+        image_ref = request.form.get('image_ref')
+        food_image = None if image_ref else request.files['food_image']
         names = []
         weights = []
         proteins = []
@@ -842,10 +1393,23 @@ def submit_food():
         food_title = ', '.join(names)
 
         # Upload and retrieve image URL            
-        image_url = upload_food_image(food_image)
+        if image_ref:
+            image_url = get_uploaded_image_url(image_ref, user_id)
+
+            # 400: Image not uploaded
+            if image_url is None:
+                response = {
+                    'status': False,
+                    'message': 'Image not uploaded!',
+                    'data': None
+                }
+                return jsonify(response), 400
+        else:
+            image_url = upload_food_image(food_image)
 
         # Store data to Realtime Database
         store_food_data(user_id, image_url, meal_category, total_calories, total_protein, total_fat, total_carb, foods, food_title)
+        bump_user_version(user_email)
 
         # Return a success response
         response = {
@@ -883,28 +1447,40 @@ def get_calories_needed():
         payload = jwt.decode(access_token, secret_key, algorithms=['HS256'])
         user_email = payload['sub']
 
-        # Get user data from Realtime Database
-        users_ref = db.reference('users')
-        user_data = users_ref.order_by_child('email').equal_to(user_email).get()
+        # Get today's date
+        today = datetime.date.today().isoformat()
 
-        # Get body measurement data
-        body_measurement_ref = db.reference('body_measurements')
-        query = body_measurement_ref.order_by_child('user_id').equal_to(list(user_data.keys())[0]).get()
-        measurement_id = list(query.keys())[0]
+        # 304: Not modified (today's entries and age both depend on the date)
+        etag = make_etag('dashboard', user_email, get_user_version(user_email), today)
+        if etag_matches(etag):
+            return not_modified(etag)
 
-        # Data needed for calculation
-        weight = query[measurement_id]['weight']
-        height = query[measurement_id]['height']
-        gender = query[measurement_id]['gender']
-        activity_level = query[measurement_id]['activity_level']
+        # Retrieve user_id from the email index
+        user_id = get_user_id_by_email(user_email)
 
-        # Retrieve user_id
-        user_id = list(user_data.keys())[0]
+        # 404: User not found
+        if user_id is None:
+            response = {
+                'status': False,
+                'message': 'User not found in the database',
+                'data': None
+            }
+            return jsonify(response), 404
+
+        # Get profile with precomputed targets
+        profile = get_user_profile(user_id)
+        # 404: No profile for this user
+        if profile is None:
+            response = {
+                'status': False,
+                'message': 'User profile not found',
+                'data': None
+            }
+            return jsonify(response), 404
 
-        # Calculate calories needed
-        age = calculate_age(user_data[user_id]['birthday'])
-        calories_needed = round(calculate_calories_needed(weight, height, age, gender, activity_level),2)
-        if calories_needed is None:
+        # 500: RTDB drops a null targets field, so a profile without targets has no key at all
+        targets = profile.get('targets')
+        if targets is None:
             response = {
                 'status': False,
                 'message': 'Failed to calculate calories needed',
@@ -912,12 +1488,8 @@ def get_calories_needed():
             }
             return jsonify(response), 500
 
-        # Get today's date
-        today = datetime.date.today().isoformat()
-
         # Get user food entries for today
-        user_food_ref = db.reference('user_food')
-        user_food_data = user_food_ref.order_by_child('user_id').equal_to(user_id).get()
+        user_food_data = query_equal_to('user_food', 'user_id', user_id)
 
         # Filter the entries for today
         today_entries = [
@@ -931,41 +1503,24 @@ def get_calories_needed():
         today_fats = round(sum(entry.get('fats', 0) for entry in today_entries), 2)
         today_carbs = round(sum(entry.get('carbs', 0) for entry in today_entries), 2)
 
-        # Calculation
-        # (protein: 10-35% calorie, fat: 20-35%, carbs: 45-65%)
-        protein = round(calories_needed * 0.2 / 4, 2)
-        carbohydrate = round(calories_needed * 0.5 / 4, 2)
-        fat = round(calories_needed * 0.3 / 9, 2)
-
         # 200: Success
-        user_response = {
-            'id': user_id,
-            'fullname': user_data[user_id]['fullname'],
-            'email': user_email,
-            'birthday': user_data[user_id]['birthday'],
-            'body_measurement': {
-                'height': query[measurement_id]['height'],
-                'weight': query[measurement_id]['weight'],
-                'activity_level': query[measurement_id]['activity_level'],
-                'gender': query[measurement_id]['gender']
-            }
-        }
+        user_response = profile_response(user_id, profile)
 
         graph = {
             'calories': {
-                'target': calories_needed,
+                'target': targets['calories'],
                 'current': today_calories
             },
             'protein': {
-                'target': protein,
+                'target': targets['protein'],
                 'current': today_proteins
             },
             'fat': {
-                'target': fat,
+                'target': targets['fat'],
                 'current': today_fats
             },
             'carbs': {
-                'target': carbohydrate,
+                'target': targets['carbs'],
                 'current': today_carbs
             }
         }
@@ -1006,7 +1561,7 @@ def get_calories_needed():
                 'history_food': history_food
             }
         }
-        return jsonify(response), 200
+        return with_etag(jsonify(response), etag), 200
 
     # 401: Unauthorized
     except jwt.exceptions.InvalidTokenError:
@@ -1019,8 +1574,8 @@ def get_calories_needed():
 
 
 # Initialize Flask
-app.debug = True
-print('Debugging message')
+# Debug also pretty-prints every JSON response, so it stays off unless asked for
+app.debug = get_config('DEBUG', False)
 CORS(app)
 
 if __name__ == '__main__':
@@ -0,0 +1,213 @@
+"""Hot/cold storage for user_food.
+
+    python meal_archive.py                          # run daily, e.g. as a Cloud Run job
+    python meal_archive.py --older-than-days 180 --dry-run
+
+Recent meals stay in user_food. Once a whole calendar month (WIB) is older
+than MEAL_ARCHIVE_AFTER_DAYS, each user's meals for that month move to one
+gzip NDJSON file in the bucket, meal_archive/<user_id>/<YYYY-MM>.ndjson.gz.
+In the database they are replaced by one summary row at
+user_food_archive/<user_id>/<YYYY-MM> with the entry count and nutrient
+totals. user_food then only ever holds the last few months, however long
+a user has been active.
+
+The job streams user_food in key order. Push keys start with the write
+time, so months come out in order: a month is flushed as soon as the
+stream has moved past it, and the stream stops at the cutoff. Memory stays
+at about one month of meals. Meals that arrive late for an archived month
+(import_data.py backfills) are merged into its file on the next run. The
+file is written first, then the summary row and the deletes go in one
+multi-path update. A crash leaves the meals either hot or archived, and a
+rerun picks up where it stopped.
+
+`iter_user_food(user_id, start_month, end_month)` is the read path: archived
+months in the range, pulled back from the bucket one at a time, then hot
+entries. meal_export.py streams it as is; `get_user_food` collects it.
+"""
+import argparse
+import gzip
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+import pytz
+from firebase_admin import db, storage
+import deadline
+from utils import BACKEND_TIMEOUT, get_config, get_date_from_timestamp, init_firebase, iter_children, \
+    push_id_timestamp, query_equal_to, read_node, reads
+
+ARCHIVE_PATH = 'user_food_archive'
+ARCHIVE_PREFIX = 'meal_archive'
+# Allowance for clock skew between a push key and the entry's own timestamp
+MONTH_SLACK = timedelta(days=1)
+
+jakarta_timezone = pytz.timezone('Asia/Jakarta')
+
+
+def entry_month(entry):
+    date = get_date_from_timestamp(entry.get('timestamp'))
+    return date[:7] if date else None
+
+
+def archive_blob_name(user_id, month):
+    return f'{ARCHIVE_PREFIX}/{user_id}/{month}.ndjson.gz'
+
+
+def in_range(month, start_month, end_month):
+    return (start_month is None or month >= start_month) and (end_month is None or month <= end_month)
+
+
+def encode_entries(entries):
+    lines = (json.dumps(dict(entry, entry_id=key)) + '\n' for key, entry in sorted(entries.items()))
+    return gzip.compress(''.join(lines).encode('utf-8'))
+
+
+def decode_entries(data):
+    entries = {}
+    for line in gzip.decompress(data).decode('utf-8').splitlines():
+        if line:
+            entry = json.loads(line)
+            entries[entry.pop('entry_id')] = entry
+    return entries
+
+
+def summarize(entries):
+    timestamps = sorted(entry['timestamp'] for entry in entries.values() if entry.get('timestamp'))
+    return {
+        'entries': len(entries),
+        'calories': round(sum(entry.get('calories', 0) for entry in entries.values()), 2),
+        'proteins': round(sum(entry.get('proteins', 0) for entry in entries.values()), 2),
+        'fats': round(sum(entry.get('fats', 0) for entry in entries.values()), 2),
+        'carbs': round(sum(entry.get('carbs', 0) for entry in entries.values()), 2),
+        'first_timestamp': timestamps[0] if timestamps else None,
+        'last_timestamp': timestamps[-1] if timestamps else None
+    }
+
+
+def get_archive_summaries(user_id):
+    return read_node(f'{ARCHIVE_PATH}/{user_id}') or {}
+
+
+def load_archived_month(user_id, month):
+    blob_name = archive_blob_name(user_id, month)
+
+    def download():
+        blob = storage.bucket().blob(blob_name)
+        return decode_entries(blob.download_as_bytes(timeout=deadline.remaining(BACKEND_TIMEOUT)))
+
+    return reads.do(blob_name, download, deadline.remaining(BACKEND_TIMEOUT))
+
+
+def iter_user_food(user_id, start_month=None, end_month=None):
+    # Hot entries are read first so a month archived meanwhile is not missed, and emitted last
+    hot = query_equal_to('user_food', 'user_id', user_id) or {}
+    for month in sorted(get_archive_summaries(user_id)):
+        if in_range(month, start_month, end_month):
+            for key, entry in sorted(load_archived_month(user_id, month).items()):
+                if key not in hot:
+                    yield key, entry
+    for key in sorted(hot):
+        entry = hot[key]
+        month = entry_month(entry)
+        if entry.get('user_id') == user_id and (month is None or in_range(month, start_month, end_month)):
+            yield key, entry
+
+
+def get_user_food(user_id, start_month=None, end_month=None):
+    return dict(iter_user_food(user_id, start_month, end_month))
+
+
+def archive_month(user_id, month, hot_entries):
+    blob_name = archive_blob_name(user_id, month)
+    summary_path = f'{ARCHIVE_PATH}/{user_id}/{month}'
+    bucket = storage.bucket()
+
+    entries = {}
+    # Generation 0: the file must not exist yet
+    generation = 0
+    # Archived before, or uploaded by a run that crashed before its summary: merge into that file
+    existing = bucket.get_blob(blob_name)
+    if existing is not None:
+        entries.update(decode_entries(existing.download_as_bytes()))
+        generation = existing.generation
+    entries.update(hot_entries)
+
+    blob = bucket.blob(blob_name)
+    # A concurrent run writing the same file fails here instead of losing meals
+    blob.upload_from_string(encode_entries(entries), content_type='application/gzip', if_generation_match=generation)
+
+    updates = {summary_path: dict(summarize(entries), blob=blob_name, archived_at=datetime.now().isoformat())}
+    for key in hot_entries:
+        updates[f'user_food/{key}'] = None
+    db.reference().update(updates)
+
+
+def run(older_than_days, page_size, dry_run):
+    cutoff = datetime.now(jakarta_timezone) - timedelta(days=older_than_days)
+    cutoff_month = cutoff.strftime('%Y-%m')
+    cutoff_month_start = jakarta_timezone.localize(datetime(cutoff.year, cutoff.month, 1))
+    stop_ms = int((cutoff_month_start + MONTH_SLACK).timestamp() * 1000)
+
+    stats = {'archived': 0, 'months': 0, 'failed_months': 0, 'skipped': 0}
+    pending = {}
+    flushed_before = None
+    started = time.monotonic()
+
+    def flush(group):
+        user_id, month = group
+        hot_entries = pending.pop(group)
+        try:
+            if not dry_run:
+                archive_month(user_id, month, hot_entries)
+            stats['archived'] += len(hot_entries)
+            stats['months'] += 1
+        except Exception:
+            stats['failed_months'] += 1
+            logging.exception('Failed to archive %s for user %s', month, user_id)
+
+    for key, entry in iter_children('user_food', page_size):
+        written_ms = push_id_timestamp(key)
+        if written_ms > stop_ms:
+            break
+
+        entry = entry or {}
+        user_id = entry.get('user_id')
+        month = entry_month(entry)
+        if not user_id or month is None or month >= cutoff_month:
+            stats['skipped'] += 1
+            continue
+        pending.setdefault((user_id, month), {})[key] = entry
+
+        # Everything before this month is complete once the stream has passed it
+        written = datetime.fromtimestamp(written_ms / 1000, jakarta_timezone) - MONTH_SLACK
+        complete_before = written.strftime('%Y-%m')
+        if complete_before != flushed_before:
+            for group in sorted(group for group in pending if group[1] < complete_before):
+                flush(group)
+            flushed_before = complete_before
+
+    for group in sorted(pending):
+        flush(group)
+
+    stats['seconds'] = round(time.monotonic() - started, 1)
+    return stats
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--older-than-days', type=int, default=get_config('MEAL_ARCHIVE_AFTER_DAYS', 90))
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--dry-run', action='store_true', help='Report what would be archived')
+    args = parser.parse_args()
+
+    init_firebase()
+    stats = run(args.older_than_days, args.page_size, args.dry_run)
+    verb = 'Would archive' if args.dry_run else 'Archived'
+    print(f'{verb} {stats["archived"]} meals in {stats["months"]} user-months '
+          f'({stats["failed_months"]} failed, {stats["skipped"]} skipped) in {stats["seconds"]}s')
+    return 1 if stats['failed_months'] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,160 @@
+"""Streaming export of meal logs as NDJSON or CSV, optionally gzipped.
+
+    python meal_export.py --output meals.ndjson.gz --include-archive
+    python meal_export.py --user <user_id> --format csv --output meals.csv
+
+Everyone's meals are read from user_food a page at a time in key order,
+plus archived months (meal_archive.py) with --include-archive, one month
+file at a time. One user's export streams meal_archive.iter_user_food,
+the archive's own read path: their archived months in order, then their
+hot entries, which the archive job keeps bounded. Rows are formatted and compressed as they are read, so memory stays flat
+however large the export is. The same generators back the /profile/export
+endpoint, where a read failing mid-stream ends an NDJSON download with an
+error_trailer line and cuts a CSV download off, instead of a file that
+looks complete.
+"""
+import argparse
+import csv
+import io
+import json
+import logging
+import sys
+import time
+import zlib
+from meal_archive import ARCHIVE_PATH, iter_user_food, load_archived_month
+from utils import init_firebase, iter_children
+
+CSV_FIELDS = ['entry_id', 'user_id', 'timestamp', 'category', 'title',
+              'calories', 'proteins', 'fats', 'carbs', 'image_url', 'foods']
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+
+def export_row(entry_id, entry):
+    # food_0..food_N children become one list
+    row = {'entry_id': entry_id}
+    foods = []
+    for key, value in entry.items():
+        if key.startswith('food_') and key[5:].isdigit():
+            foods.append((int(key[5:]), value))
+        else:
+            row[key] = value
+    row['foods'] = [food for _, food in sorted(foods, key=lambda item: item[0])]
+    return row
+
+
+def iter_all_meals(page_size=1000, include_archive=False):
+    if include_archive:
+        for user_id, months in iter_children(ARCHIVE_PATH, page_size):
+            for month in sorted(months or {}):
+                yield from sorted(load_archived_month(user_id, month).items())
+    for entry_id, entry in iter_children('user_food', page_size):
+        if entry:
+            yield entry_id, entry
+
+
+def format_rows(meals, fmt):
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        for entry_id, entry in meals:
+            row = export_row(entry_id, entry)
+            row['foods'] = json.dumps(row['foods'])
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+    else:
+        for entry_id, entry in meals:
+            yield json.dumps(export_row(entry_id, entry)) + '\n'
+
+
+def error_trailer(fmt, message):
+    # Last line of an NDJSON export that stopped early. CSV has no line that
+    # readers would not take for data, so there is none and the stream is cut
+    if fmt == 'csv':
+        return None
+    return json.dumps({'error': 'export incomplete', 'message': message}) + '\n'
+
+
+def encode_chunks(chunks, compress=False, chunk_size=64 * 1024):
+    # Bytes in chunks of about chunk_size, gzip-compressed on the fly when asked
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    pending = []
+    pending_size = 0
+    for chunk in chunks:
+        data = chunk.encode('utf-8')
+        if compressor is not None:
+            data = compressor.compress(data)
+        if data:
+            pending.append(data)
+            pending_size += len(data)
+        if pending_size >= chunk_size:
+            yield b''.join(pending)
+            pending = []
+            pending_size = 0
+    if compressor is not None:
+        pending.append(compressor.flush())
+    if pending:
+        yield b''.join(pending)
+
+
+class ExportProgress:
+    """Counts rows passing through and reports the rate."""
+
+    def __init__(self, meals, report_every=0, stream=sys.stderr):
+        self.meals = meals
+        self.report_every = report_every
+        self.stream = stream
+        self.rows = 0
+        self.started = time.monotonic()
+
+    def __iter__(self):
+        for meal in self.meals:
+            self.rows += 1
+            if self.report_every and self.rows % self.report_every == 0:
+                print(self.summary(), file=self.stream)
+            yield meal
+
+    @property
+    def rows_per_second(self):
+        elapsed = time.monotonic() - self.started
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+    def summary(self):
+        return f'{self.rows} rows, {self.rows_per_second:.0f} rows/s'
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', default='-', help='File to write, - for stdout')
+    parser.add_argument('--format', choices=sorted(CONTENT_TYPES), default='ndjson')
+    parser.add_argument('--gzip', action='store_true', help='Compress (implied by a .gz output)')
+    parser.add_argument('--user', help='Export one user, including archived months')
+    parser.add_argument('--include-archive', action='store_true', help='Also export archived months of everyone')
+    parser.add_argument('--page-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    init_firebase()
+    meals = iter_user_food(args.user) if args.user else iter_all_meals(args.page_size, args.include_archive)
+    progress = ExportProgress(meals, report_every=10000)
+    compress = args.gzip or args.output.endswith('.gz')
+
+    output = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+    try:
+        for data in encode_chunks(format_rows(progress, args.format), compress):
+            output.write(data)
+    finally:
+        if output is not sys.stdout.buffer:
+            output.close()
+    print(f'Done: {progress.summary()}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Report memory per gunicorn worker, to compare preload on and off.
+
+    GUNICORN_PRELOAD=0 GUNICORN_WORKERS=4 gunicorn -c gunicorn.conf.py main:app &
+    python measure_worker_rss.py --output preload_off.json
+    GUNICORN_PRELOAD=1 GUNICORN_WORKERS=4 gunicorn -c gunicorn.conf.py main:app &
+    python measure_worker_rss.py --output preload_on.json
+
+Send a few /master/scan_nutrition requests first so every worker has
+loaded and run the model. RSS counts shared pages in every process that
+maps them; PSS splits them between the sharers, so the sum of PSS is what
+the instance really uses. With preload the shared column should hold most
+of each worker's RSS.
+"""
+import argparse
+import json
+import os
+
+
+def find_master():
+    # Oldest gunicorn process whose parent is not gunicorn
+    candidates = []
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f'/proc/{pid}/cmdline', 'rb') as f:
+                cmdline = f.read().replace(b'\0', b' ').decode(errors='replace')
+        except OSError:
+            continue
+        if 'gunicorn' in cmdline:
+            candidates.append(int(pid))
+    masters = [pid for pid in candidates if read_ppid(pid) not in candidates]
+    if not masters:
+        raise SystemExit('No gunicorn master found, pass --pid')
+    return min(masters)
+
+
+def read_ppid(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        return int(f.read().rsplit(')', 1)[1].split()[1])
+
+
+def children(pid):
+    pids = []
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                if read_ppid(int(entry)) == pid:
+                    pids.append(int(entry))
+            except OSError:
+                continue
+    return sorted(pids)
+
+
+def memory(pid):
+    # Values in MB from smaps_rollup (kB in the file)
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return {
+        'rss_mb': round(fields.get('Rss', 0), 1),
+        'pss_mb': round(fields.get('Pss', 0), 1),
+        'shared_mb': round(fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0), 1),
+        'private_mb': round(fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0), 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pid', type=int, help='gunicorn master pid (found automatically by default)')
+    parser.add_argument('--output', help='Write the JSON report here as well')
+    args = parser.parse_args()
+
+    master = args.pid or find_master()
+    workers = {pid: memory(pid) for pid in children(master)}
+    report = {
+        'master': {'pid': master, **memory(master)},
+        'workers': [{'pid': pid, **stats} for pid, stats in workers.items()],
+        'total_pss_mb': round(memory(master)['pss_mb'] + sum(w['pss_mb'] for w in workers.values()), 1)
+    }
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""Build and check the users_by_email index.
+
+    python migrate_email_index.py build    # index every existing user
+    python migrate_email_index.py check    # report mismatches
+    python migrate_email_index.py check --fix
+
+`build` is idempotent and never overwrites an entry that already points
+at another user; those are reported as conflicts. It reads the existing
+index once up front, a page at a time, instead of once per user.
+An entry a registration claims meanwhile points at that same user, so
+writing it again from the snapshot is harmless. When several users
+share an email the one with the smallest key wins, which is the record
+the old order_by_child('email') lookups returned.
+
+`check --fix` deletes a dangling entry (no user with that email) only
+after re-reading its user, and never one whose push key is newer than the
+check itself: the users scan runs before the index scan, so an account
+registered in between would otherwise lose its entry.
+"""
+import argparse
+import sys
+import time
+from firebase_admin import db
+from utils import hash_email, init_firebase, iter_children, push_id_timestamp
+
+INDEX_PATH = 'users_by_email'
+
+
+def build(page_size):
+    indexed = 0
+    conflicts = []
+    seen = set()
+    index = dict(iter_children(INDEX_PATH, page_size))
+
+    pending = {}
+    for user_id, user in iter_children('users', page_size):
+        email = (user or {}).get('email')
+        if not email:
+            continue
+        email_hash = hash_email(email)
+        if email_hash in seen:
+            conflicts.append((email, user_id, 'duplicate email, kept the earlier user'))
+            continue
+        seen.add(email_hash)
+        pending[email_hash] = (email, user_id)
+
+        if len(pending) >= page_size:
+            indexed += write_index_page(pending, index, conflicts)
+            pending = {}
+
+    if pending:
+        indexed += write_index_page(pending, index, conflicts)
+
+    print(f'Indexed {indexed} users, {len(conflicts)} conflicts')
+    for email, user_id, reason in conflicts:
+        print(f'  {user_id} <{email}>: {reason}')
+    return not conflicts
+
+
+def write_index_page(entries, index, conflicts):
+    # Only fill entries the index does not have, so registrations are not overwritten
+    updates = {}
+    for email_hash, (email, user_id) in entries.items():
+        current = index.get(email_hash)
+        if current is None:
+            updates[email_hash] = user_id
+        elif current != user_id:
+            conflicts.append((email, user_id, f'index already points at {current}'))
+    if updates:
+        db.reference(INDEX_PATH).update(updates)
+        index.update(updates)
+    return len(updates)
+
+
+def registered_since(user_id, started_ms):
+    try:
+        created_ms = push_id_timestamp(user_id)
+    except ValueError:
+        return False
+    # Keys that are not push keys decode to arbitrary times, mostly far in the future
+    return started_ms <= created_ms <= time.time() * 1000 + 60000
+
+
+def release_dangling(email_hash, user_id, started_ms):
+    # The users scan runs first, so an account registered meanwhile looks dangling
+    if registered_since(user_id, started_ms):
+        return False
+    user = db.reference('users/' + user_id).get()
+    if user and user.get('email') and hash_email(user['email']) == email_hash:
+        return False
+    # Only delete the entry if it still points at the same user
+    owner = db.reference(f'{INDEX_PATH}/{email_hash}').transaction(lambda current: None if current == user_id else current)
+    return owner is None
+
+
+def check(page_size, fix):
+    problems = []
+    started_ms = int(time.time() * 1000)
+
+    # Every user is reachable through the index
+    owners = {}
+    for user_id, user in iter_children('users', page_size):
+        email = (user or {}).get('email')
+        if not email:
+            continue
+        owners.setdefault(hash_email(email), user_id)
+
+    index = dict(iter_children(INDEX_PATH, page_size))
+    for email_hash, user_id in owners.items():
+        if email_hash not in index:
+            problems.append(('missing', email_hash, user_id))
+        elif index[email_hash] != user_id:
+            problems.append(('wrong owner', email_hash, user_id))
+
+    # Every index entry points at a user with that email
+    for email_hash, user_id in index.items():
+        if email_hash not in owners:
+            problems.append(('dangling', email_hash, None))
+
+    print(f'Checked {len(owners)} users and {len(index)} index entries, {len(problems)} problems')
+    for kind, email_hash, user_id in problems:
+        print(f'  {kind}: {email_hash} -> {index.get(email_hash)} (expected {user_id})')
+
+    if fix and problems:
+        updates = {email_hash: user_id for kind, email_hash, user_id in problems if kind != 'dangling'}
+        if updates:
+            db.reference(INDEX_PATH).update(updates)
+        dangling = [email_hash for kind, email_hash, _ in problems if kind == 'dangling']
+        released = sum(release_dangling(email_hash, index[email_hash], started_ms) for email_hash in dangling)
+        print(f'Fixed {len(updates) + released} entries, kept {len(dangling) - released} dangling entries '
+              f'whose user exists or registered during the check')
+
+    return not problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['build', 'check'])
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--fix', action='store_true', help='Rewrite missing, wrong and dangling entries (check only)')
+    args = parser.parse_args()
+
+    init_firebase()
+    if args.command == 'build':
+        ok = build(args.page_size)
+    else:
+        ok = check(args.page_size, args.fix)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+"""Opt-in per-request profiling.
+
+A request is profiled when it carries a valid `X-Profile-Request` header
+or is picked by PROFILE_SAMPLE_RATE. The header is `<unix time>:<hmac>`
+where hmac is HMAC-SHA256 of `<unix time>:<path>` with PROFILE_SECRET,
+accepted for five minutes:
+
+    python profiling.py sign /master/dashboard
+
+For each profiled request two files are written to PROFILE_DIR, named
+after the time, route and request id:
+
+- `.prof` (cProfile, open with pstats or snakeviz) or `.folded` (stack
+  samples for flamegraph.pl / speedscope, PROFILE_MODE = 'sample')
+- `.json` with wall and CPU time, status and allocation stats
+
+The sampler sees every Python frame, including ones blocked in I/O or
+inside TensorFlow, so wall time that cProfile attributes to a single
+builtin call shows where it was spent. Allocation tracing is process
+wide, so only one request at a time gets allocation stats.
+
+When neither a secret nor a sample rate is configured no hooks are
+registered and requests run exactly as without this module.
+"""
+import cProfile
+import hashlib
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from flask import g, request
+
+HEADER = 'X-Profile-Request'
+SIGNATURE_MAX_AGE = 300
+
+tracemalloc_lock = threading.Lock()
+
+
+def sign(secret, path, timestamp=None):
+    timestamp = str(int(timestamp if timestamp is not None else time.time()))
+    digest = hmac.new(secret.encode('utf-8'), f'{timestamp}:{path}'.encode('utf-8'), hashlib.sha256).hexdigest()
+    return f'{timestamp}:{digest}'
+
+
+def verify(secret, path, header):
+    try:
+        timestamp, _ = header.split(':', 1)
+        if abs(time.time() - int(timestamp)) > SIGNATURE_MAX_AGE:
+            return False
+    except ValueError:
+        return False
+    return hmac.compare_digest(sign(secret, path, timestamp), header)
+
+
+class StackSampler:
+    """Samples one thread's Python stack from a background thread."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+def init_profiling(app, output_dir, sample_rate=0.0, secret='', mode='cprofile', sample_interval=0.005):
+    if sample_rate <= 0 and not secret:
+        return
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    def should_profile():
+        header = request.headers.get(HEADER)
+        if header and secret and verify(secret, request.path, header):
+            return True
+        return sample_rate > 0 and random.random() < sample_rate
+
+    @app.before_request
+    def start_profile():
+        if not should_profile():
+            return
+
+        state = {
+            'request_id': request.headers.get('X-Request-Id') or uuid.uuid4().hex,
+            'traced': tracemalloc_lock.acquire(blocking=False)
+        }
+        if state['traced']:
+            tracemalloc.start()
+
+        if mode == 'sample':
+            state['sampler'] = StackSampler(threading.get_ident(), sample_interval)
+            state['sampler'].start()
+        else:
+            state['profiler'] = cProfile.Profile()
+            state['profiler'].enable()
+
+        state['wall_start'] = time.perf_counter()
+        state['cpu_start'] = time.thread_time()
+        g.profile = state
+
+    @app.after_request
+    def record_status(response):
+        if 'profile' in g:
+            g.profile['status'] = response.status_code
+        return response
+
+    @app.teardown_request
+    def stop_profile(exc):
+        state = g.pop('profile', None)
+        if state is None:
+            return
+
+        wall_ms = (time.perf_counter() - state['wall_start']) * 1000
+        cpu_ms = (time.thread_time() - state['cpu_start']) * 1000
+
+        if 'profiler' in state:
+            state['profiler'].disable()
+        else:
+            state['sampler'].stop()
+
+        summary = {
+            'route': request.url_rule.rule if request.url_rule else request.path,
+            'method': request.method,
+            'request_id': state['request_id'],
+            'status': state.get('status', 500 if exc else None),
+            'wall_ms': round(wall_ms, 2),
+            'cpu_ms': round(cpu_ms, 2),
+            # Wall time not spent on this thread's CPU: I/O, locks, TF's own thread pools
+            'off_cpu_ms': round(max(0.0, wall_ms - cpu_ms), 2)
+        }
+
+        if state['traced']:
+            try:
+                current, peak = tracemalloc.get_traced_memory()
+                top = tracemalloc.take_snapshot().statistics('lineno')[:20]
+            finally:
+                tracemalloc.stop()
+                tracemalloc_lock.release()
+            summary['allocations'] = {
+                'current_kb': round(current / 1024, 1),
+                'peak_kb': round(peak / 1024, 1),
+                'top': [{'where': str(stat.traceback), 'size_kb': round(stat.size / 1024, 1), 'count': stat.count} for stat in top]
+            }
+
+        route_name = re.sub(r'[^A-Za-z0-9]+', '_', summary['route']).strip('_') or 'root'
+        # X-Request-Id comes from the client, so only its safe characters reach the file name
+        file_id = re.sub(r'[^A-Za-z0-9]+', '_', state['request_id']).strip('_')[:64] or uuid.uuid4().hex
+        base_path = os.path.join(output_dir, f'{time.strftime("%Y%m%dT%H%M%S")}-{route_name}-{file_id}')
+        if 'profiler' in state:
+            state['profiler'].dump_stats(base_path + '.prof')
+        else:
+            state['sampler'].write(base_path + '.folded')
+        with open(base_path + '.json', 'w') as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3 or sys.argv[1] != 'sign':
+        sys.exit('usage: python profiling.py sign <path>')
+    from utils import get_config
+    print(f'{HEADER}: {sign(get_config("PROFILE_SECRET", ""), sys.argv[2])}')
@@ -0,0 +1,78 @@
+"""Build post-training quantized TFLite versions of the food classifier.
+
+    python quantize_model.py --model model.h5 --calibration-dir calib/ --mode both
+
+`dynamic` quantizes weights to int8 and keeps float activations. `int8`
+quantizes weights and activations (int8 input and output too) using the
+calibration images to estimate activation ranges. Check the result with
+evaluate_quantized.py before pointing MODEL_PATH at it.
+"""
+import argparse
+import os
+import tensorflow as tf
+from inference import preprocess_image
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def list_images(directory):
+    paths = []
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(root, name))
+    return sorted(paths)
+
+
+def representative_dataset(calibration_dir, limit):
+    paths = list_images(calibration_dir)[:limit]
+    if not paths:
+        raise SystemExit(f'No calibration images found in {calibration_dir}')
+
+    def generator():
+        for path in paths:
+            yield [preprocess_image(path)]
+
+    return generator
+
+
+def convert(model, mode, calibration_dir=None, limit=200):
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    if mode == 'int8':
+        converter.representative_dataset = representative_dataset(calibration_dir, limit)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+
+    return converter.convert()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default='model.h5')
+    parser.add_argument('--calibration-dir', help='Folder of representative food images (required for int8)')
+    parser.add_argument('--num-calibration', type=int, default=200)
+    parser.add_argument('--mode', choices=['dynamic', 'int8', 'both'], default='both')
+    parser.add_argument('--output-dir', default='.')
+    args = parser.parse_args()
+
+    modes = ['dynamic', 'int8'] if args.mode == 'both' else [args.mode]
+    if 'int8' in modes and not args.calibration_dir:
+        parser.error('--calibration-dir is required for int8 quantization')
+
+    model = tf.keras.models.load_model(args.model, compile=False)
+    base_name = os.path.splitext(os.path.basename(args.model))[0]
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    for mode in modes:
+        tflite_model = convert(model, mode, args.calibration_dir, args.num_calibration)
+        output_path = os.path.join(args.output_dir, f'{base_name}_{mode}.tflite')
+        with open(output_path, 'wb') as f:
+            f.write(tflite_model)
+        print(f'{mode}: wrote {output_path} ({len(tflite_model) / (1024 * 1024):.1f} MB)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""Re-run the classifier over stored meal photos.
+
+    python rescore_meals.py --output rescored.ndjson --checkpoint rescored.ckpt
+    python rescore_meals.py --image-dir /mnt/meal-images --model model_int8.tflite ...
+
+Meal entries are streamed from user_food in key order, a page at a time.
+Images are read from the bucket (or from --image-dir, laid out like the
+bucket) and decoded in a pool of worker processes that keeps --prefetch
+images in flight ahead of the model. Decoded images are classified in
+batches of --batch-size. Each result is appended to the NDJSON output
+with the stored title, the labels detected at the serving threshold and
+the raw scores. That makes drift easy to measure and labels easy to
+backfill.
+
+The last entry written is saved to the checkpoint after every batch; a
+re-run with the same --output and --checkpoint continues from there.
+Memory is bounded by the prefetch window and one batch.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import numpy as np
+from firebase_admin import storage
+from images import decode_image_array
+from utils import CLASS_LABELS, blob_name_from_url, get_config, init_firebase, iter_children
+
+# Set in each decode process by init_decoder
+image_dir = None
+
+
+def init_decoder(local_dir):
+    global image_dir
+    image_dir = local_dir
+    if image_dir is None:
+        init_firebase()
+
+
+def fetch_and_decode(entry_id, blob_name):
+    try:
+        if image_dir is not None:
+            with open(os.path.join(image_dir, blob_name), 'rb') as f:
+                data = f.read()
+        else:
+            data = storage.bucket().blob(blob_name).download_as_bytes()
+        return entry_id, decode_image_array(data), None
+    except Exception as e:
+        return entry_id, None, f'{type(e).__name__}: {e}'
+
+
+def iter_meals(start_after, page_size):
+    for entry_id, entry in iter_children('user_food', page_size, start_after):
+        yield entry_id, entry or {}
+
+
+def load_checkpoint(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {'last_entry_id': None, 'processed': 0}
+
+
+def save_checkpoint(path, checkpoint):
+    if not path:
+        return
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+def run(args):
+    # TF is only needed in this process, the decode workers never import it
+    from inference import DETECTION_THRESHOLD, ModelManager, configure_tf_threads
+
+    configure_tf_threads(args.tf_threads, 1)
+    manager = ModelManager(args.model, poll_interval=0, num_threads=args.tf_threads)
+    active = manager.load()
+
+    checkpoint = load_checkpoint(args.checkpoint)
+    output = open(args.output, 'a')
+    started = time.monotonic()
+    processed = 0
+
+    # Entries waiting for their image, in key order, so output and checkpoint stay ordered
+    pending = deque()
+    batch = []
+
+    def write_batch():
+        nonlocal processed
+        images = [item['image'] for item in batch if item['image'] is not None]
+        scores = []
+        if images:
+            x = np.stack(images).astype(np.float32) / 255
+            scores = list(active.model.predict(x, batch_size=len(images)))
+
+        for item in batch:
+            entry = item['entry']
+            record = {
+                'entry_id': item['entry_id'],
+                'user_id': entry.get('user_id'),
+                'image_url': entry.get('image_url'),
+                'stored_title': entry.get('title'),
+                'model_version': active.version
+            }
+            if item['image'] is None:
+                record['error'] = item['error']
+            else:
+                entry_scores = scores.pop(0)
+                record['labels'] = [CLASS_LABELS[i] for i in np.where(entry_scores > DETECTION_THRESHOLD)[0]]
+                record['scores'] = [round(float(score), 4) for score in entry_scores]
+            output.write(json.dumps(record) + '\n')
+
+        output.flush()
+        processed += len(batch)
+        checkpoint['last_entry_id'] = batch[-1]['entry_id']
+        checkpoint['processed'] += len(batch)
+        save_checkpoint(args.checkpoint, checkpoint)
+        batch.clear()
+
+        elapsed = time.monotonic() - started
+        print(f'{checkpoint["processed"]} processed, {processed / elapsed:.1f} images/s', file=sys.stderr)
+
+    def collect(item):
+        if item['future'] is not None:
+            _, item['image'], item['error'] = item['future'].result()
+        batch.append(item)
+        if len(batch) >= args.batch_size:
+            write_batch()
+
+    executor = ProcessPoolExecutor(
+        max_workers=args.workers,
+        mp_context=get_context('spawn'),
+        initializer=init_decoder,
+        initargs=(args.image_dir,)
+    )
+    try:
+        for entry_id, entry in iter_meals(checkpoint['last_entry_id'], args.page_size):
+            if args.limit and checkpoint['processed'] + len(pending) + len(batch) >= args.limit:
+                break
+            blob_name = blob_name_from_url(entry.get('image_url'))
+            item = {'entry_id': entry_id, 'entry': entry, 'image': None, 'error': 'no image', 'future': None}
+            if blob_name:
+                item['future'] = executor.submit(fetch_and_decode, entry_id, blob_name)
+            pending.append(item)
+
+            # Bounded prefetch: wait for the oldest image before reading further
+            while len(pending) >= args.prefetch:
+                collect(pending.popleft())
+
+        while pending:
+            collect(pending.popleft())
+        if batch:
+            write_batch()
+    finally:
+        executor.shutdown(cancel_futures=True)
+        output.close()
+
+    elapsed = time.monotonic() - started
+    print(f'Done: {processed} images in {elapsed:.1f}s', file=sys.stderr)
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=get_config('MODEL_PATH', 'model.h5'))
+    parser.add_argument('--output', required=True, help='NDJSON file, appended to')
+    parser.add_argument('--checkpoint', help='Progress file used to resume')
+    parser.add_argument('--image-dir', help='Read images from this directory instead of the bucket')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=cpus, help='Decode processes')
+    parser.add_argument('--prefetch', type=int, default=256, help='Images fetched or decoded ahead of the model')
+    parser.add_argument('--tf-threads', type=int, default=cpus, help='TensorFlow intra-op threads')
+    parser.add_argument('--page-size', type=int, default=1000, help='user_food entries read per request')
+    parser.add_argument('--limit', type=int, default=0, help='Stop after this many entries in total')
+    args = parser.parse_args()
+
+    init_firebase()
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""JSON encoding and compression for every response.
+
+`init_responses(app)` swaps Flask's JSON provider for one backed by
+orjson, so `jsonify` and `request.get_json` keep working unchanged, and
+compresses response bodies of at least `min_size` bytes with brotli or
+gzip, whichever the client accepts (brotli preferred). Without orjson
+or brotli installed it falls back to the stdlib encoder and gzip.
+
+Streamed and already encoded responses are left alone. A compressed
+response gets `Vary: Accept-Encoding` and its ETag suffixed with the
+encoding (`"dashboard-...-gzip"`), so each encoding of a resource has its
+own validator; utils.etag_matches accepts the suffixed forms.
+"""
+import gzip
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'text/')
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Same output as Flask's provider (sorted keys, compact unless debug) via orjson.
+
+    Anything orjson rejects (ints beyond 64 bits, unknown types without a
+    `default`) goes through the stdlib encoder instead of failing.
+    """
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None:
+            option = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+            if kwargs.get('indent'):
+                option |= orjson.OPT_INDENT_2
+            try:
+                return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+            except TypeError:
+                pass
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+
+def choose_encoding(accept_encodings):
+    if brotli is not None and accept_encodings.quality('br') > 0:
+        return 'br'
+    if accept_encodings.quality('gzip') > 0:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding, gzip_level=6, brotli_quality=4):
+    if encoding == 'br':
+        return brotli.compress(data, quality=brotli_quality)
+    return gzip.compress(data, compresslevel=gzip_level)
+
+
+def init_responses(app, min_size=1024, gzip_level=6, brotli_quality=4):
+    app.json = FastJSONProvider(app)
+
+    @app.after_request
+    def compress_response(response):
+        if (response.status_code < 200 or response.status_code in (204, 304)
+                or response.is_streamed or response.direct_passthrough
+                or 'Content-Encoding' in response.headers
+                or not (response.mimetype or '').startswith(COMPRESSIBLE_TYPES)):
+            return response
+
+        # Caches must key on Accept-Encoding even when this body stays uncompressed
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.accept_encodings)
+        data = response.get_data()
+        if encoding is None or len(data) < min_size:
+            return response
+
+        response.set_data(compress(data, encoding, gzip_level, brotli_quality))
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(f'{etag}-{encoding}', weak)
+        return response
@@ -0,0 +1,119 @@
+"""Process sizing from the container's CPU and memory limits.
+
+Cloud Run enforces CPU and memory with cgroups, while os.cpu_count() and
+TensorFlow's own defaults see every core of the host. This reads the
+cgroup limits (v2, falling back to v1, then to the CPU affinity mask) and
+derives:
+
+- gunicorn workers: one per whole CPU, as many as WORKER_MEMORY_MB fits
+- gunicorn threads per worker: 4 per CPU share, at least 8
+- inference concurrency: 2 when a worker has 2 or more CPUs, else 1
+- TF intra-op threads: the worker's CPU share split between concurrent
+  predictions (at least 1), so they do not oversubscribe it; inter-op: 1.
+  The intra-op count is also each TFLite interpreter's num_threads
+
+GUNICORN_WORKERS, GUNICORN_THREADS (or WEB_THREADS), TF_INTRA_OP_THREADS,
+TF_INTER_OP_THREADS and INFERENCE_CONCURRENCY override a derived value
+when set to anything but 0. gunicorn.conf.py logs the result at boot.
+"""
+import math
+import os
+from collections import namedtuple
+from functools import lru_cache
+from utils import get_config
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+# cgroup v1 reports "no limit" as a huge page-aligned number
+UNLIMITED_MEMORY = 1 << 60
+
+RuntimeConfig = namedtuple('RuntimeConfig', [
+    'cpu_limit', 'memory_limit_mb', 'workers', 'threads',
+    'tf_intra_op_threads', 'tf_inter_op_threads', 'inference_concurrency', 'overrides'
+])
+
+
+def read_file(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def read_cpu_limit():
+    available = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+
+    quota = period = None
+    cpu_max = read_file(f'{CGROUP_ROOT}/cpu.max')
+    if cpu_max:
+        # "<quota> <period>" or "max <period>"
+        value, _, period_value = cpu_max.partition(' ')
+        if value != 'max':
+            quota, period = int(value), int(period_value or 100000)
+    else:
+        quota_value = read_file(f'{CGROUP_ROOT}/cpu/cpu.cfs_quota_us')
+        period_value = read_file(f'{CGROUP_ROOT}/cpu/cpu.cfs_period_us')
+        if quota_value and period_value and int(quota_value) > 0:
+            quota, period = int(quota_value), int(period_value)
+
+    if quota is None:
+        return float(available)
+    return min(float(available), quota / period)
+
+
+def read_memory_limit_mb():
+    value = read_file(f'{CGROUP_ROOT}/memory.max') or read_file(f'{CGROUP_ROOT}/memory/memory.limit_in_bytes')
+    if value is None or value == 'max' or int(value) >= UNLIMITED_MEMORY:
+        return None
+    return int(value) // (1024 * 1024)
+
+
+@lru_cache(maxsize=1)
+def get_runtime_config():
+    cpu_limit = read_cpu_limit()
+    memory_limit_mb = read_memory_limit_mb()
+    overrides = []
+
+    def override(*names):
+        for name in names:
+            value = get_config(name, 0)
+            if value:
+                overrides.append(name)
+                return int(value)
+        return None
+
+    workers = override('GUNICORN_WORKERS')
+    if workers is None:
+        workers = max(1, math.floor(cpu_limit))
+        if memory_limit_mb is not None:
+            workers = max(1, min(workers, memory_limit_mb // get_config('WORKER_MEMORY_MB', 1024)))
+
+    cpus_per_worker = max(1, math.floor(cpu_limit / workers))
+
+    threads = override('GUNICORN_THREADS', 'WEB_THREADS') or max(8, 4 * cpus_per_worker)
+    inference_concurrency = override('INFERENCE_CONCURRENCY') or (2 if cpus_per_worker >= 2 else 1)
+    tf_intra_op_threads = override('TF_INTRA_OP_THREADS') or max(1, cpus_per_worker // inference_concurrency)
+    tf_inter_op_threads = override('TF_INTER_OP_THREADS') or 1
+
+    return RuntimeConfig(
+        cpu_limit=round(cpu_limit, 2),
+        memory_limit_mb=memory_limit_mb,
+        workers=workers,
+        threads=threads,
+        tf_intra_op_threads=tf_intra_op_threads,
+        tf_inter_op_threads=tf_inter_op_threads,
+        inference_concurrency=inference_concurrency,
+        overrides=tuple(overrides)
+    )
+
+
+def describe(runtime):
+    overridden = ', '.join(runtime.overrides) or 'none'
+    return (f'cpu_limit={runtime.cpu_limit} memory_limit_mb={runtime.memory_limit_mb} '
+            f'workers={runtime.workers} threads={runtime.threads} '
+            f'tf_threads={runtime.tf_intra_op_threads}/{runtime.tf_inter_op_threads} '
+            f'inference_concurrency={runtime.inference_concurrency} (overridden: {overridden})')
+
+
+if __name__ == '__main__':
+    print(describe(get_runtime_config()))
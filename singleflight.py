@@ -0,0 +1,73 @@
+import copy
+import threading
+from concurrent.futures import TimeoutError
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """Collapses concurrent identical calls into one.
+
+    The first caller for a key runs the function; callers arriving while it
+    is in flight wait up to `timeout` seconds and get a copy of its result
+    (or its exception). The leader keeps the result itself; only when
+    someone joined does it first take a snapshot for them to copy from, so
+    an uncontended read costs no copy and a caller mutating its result
+    never races a follower's copy.
+    Nothing is kept once the call returns, so this never serves a result
+    older than a call that was already running when the caller arrived.
+    Writers call `forget(key)` after writing so that readers arriving
+    afterwards start a fresh call instead of joining one that began before
+    the write.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.shared = 0
+
+    def do(self, key, fn, timeout=None):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                call.followers += 1
+                self.shared += 1
+
+        if not leader:
+            if not call.done.wait(timeout):
+                raise TimeoutError(f'Timed out waiting for in-flight call {key}')
+            if call.error is not None:
+                raise call.error
+            # Callers may mutate what they get back
+            return copy.deepcopy(call.result)
+
+        result = None
+        try:
+            result = fn()
+            return result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+                followers = call.followers
+            # Nobody can join any more; snapshot before the leader's caller can mutate the result
+            if followers and call.error is None:
+                call.result = copy.deepcopy(result)
+            call.done.set()
+
+    def forget(self, key):
+        with self._lock:
+            self._calls.pop(key, None)
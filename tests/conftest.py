@@ -0,0 +1,102 @@
+import importlib
+import os
+import sys
+import pytest
+from google.api_core.exceptions import PreconditionFailed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# config.py holds deploy secrets and is not in the repository
+try:
+    import config
+except ImportError:
+    sys.modules['config'] = importlib.import_module('config_example')
+
+import main
+import utils
+
+SECRET_KEY = 'test-secret-key-for-signing-tokens'
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.signed_urls = []
+
+    @property
+    def public_url(self):
+        return f'https://storage.googleapis.com/{self.bucket.name}/{self.name}'
+
+    def exists(self, timeout=None):
+        return self.name in self.bucket.objects
+
+    @property
+    def generation(self):
+        # Objects a test put straight into `objects` are at generation 1
+        if self.name not in self.bucket.objects:
+            return None
+        return self.bucket.generations.get(self.name, 1)
+
+    def download_as_bytes(self, timeout=None):
+        return self.bucket.objects[self.name]
+
+    def generate_signed_url(self, **kwargs):
+        self.bucket.signed.append((self.name, kwargs))
+        return f'https://signed.example/{self.name}'
+
+    def upload_from_string(self, data, content_type=None, timeout=None, if_generation_match=None):
+        generation = self.generation or 0
+        if if_generation_match is not None and if_generation_match != generation:
+            raise PreconditionFailed(f'{self.name} is not at generation {if_generation_match}')
+        self.bucket.objects[self.name] = data
+        self.bucket.generations[self.name] = generation + 1
+
+    def upload_from_file(self, file, timeout=None):
+        self.bucket.objects[self.name] = file.read()
+
+    def delete(self):
+        self.bucket.objects.pop(self.name, None)
+
+
+class FakeBucket:
+    """The parts of a Cloud Storage bucket the app uses, kept in memory."""
+
+    def __init__(self, name='test-bucket'):
+        self.name = name
+        self.objects = {}
+        self.generations = {}
+        self.signed = []
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def get_blob(self, name):
+        return FakeBlob(self, name) if name in self.objects else None
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    fake = FakeBucket()
+    monkeypatch.setattr(utils.storage, 'bucket', lambda *args, **kwargs: fake)
+    return fake
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # Skip Firebase, model and index start-up, routes under test never reach them
+    monkeypatch.setattr(main, 'worker_started', True)
+    monkeypatch.setattr(main, 'secret_key', SECRET_KEY)
+    monkeypatch.setitem(main.app.config, 'TESTING', True)
+    return main.app.test_client()
+
+
+@pytest.fixture
+def user(monkeypatch):
+    # A registered user as seen through the email index
+    email = 'siti@example.com'
+    user_id = '-NjEtLWvhlL1rak30Xwd'
+    monkeypatch.setattr(main, 'get_user_id_by_email', lambda value: user_id if value == email else None)
+    token = utils.create_access_token_with_claims(email, SECRET_KEY)
+    return {'email': email, 'user_id': user_id, 'headers': {'Authorization': f'Bearer {token}'}}
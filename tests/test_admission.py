@@ -0,0 +1,51 @@
+import pytest
+import main
+from admission import AdmissionController, AdmissionRejected, create_inference_controller
+
+
+def test_reserve_rejects_once_slots_and_queue_are_full():
+    controller = AdmissionController('inference', concurrency=1, queue_size=0, max_wait=1.0)
+    reservation = controller.reserve()
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.reserve()
+    assert rejected.value.status_code == 429
+    assert controller.stats()['rejected_queue_full'] == 1
+    reservation.release()
+    reservation.release()
+    assert controller.stats()['reserved'] == 0
+    controller.reserve()
+
+
+def test_reservation_keeps_its_place_against_later_arrivals():
+    controller = AdmissionController('inference', concurrency=1, queue_size=0, max_wait=1.0)
+    reservation = controller.reserve()
+    # A later request without a reservation cannot take the reserved place
+    with pytest.raises(AdmissionRejected):
+        with controller.slot():
+            pass
+    with controller.slot(reservation=reservation):
+        assert controller.stats()['active'] == 1
+    reservation.release()
+    assert controller.stats()['reserved'] == 0
+
+
+def test_reserved_threads_are_never_lent_to_inference():
+    controller = create_inference_controller(web_threads=8, concurrency=8, queue_size=8, max_wait=1.0, reserved_threads=2)
+    assert controller.concurrency + controller.queue_size == 6
+
+
+def test_reserve_larger_than_the_pool_is_clamped_and_logged(caplog):
+    controller = create_inference_controller(web_threads=2, concurrency=2, queue_size=4, max_wait=1.0, reserved_threads=4)
+    assert (controller.concurrency, controller.queue_size) == (1, 0)
+    assert 'INFERENCE_RESERVED_THREADS=4' in caplog.text
+
+
+@pytest.mark.parametrize('route', ['/master/scan_nutrition', '/master/scan_and_submit'])
+def test_full_scan_routes_shed_before_reading_the_request(client, monkeypatch, route):
+    controller = AdmissionController('inference', concurrency=1, queue_size=0, max_wait=1.0)
+    monkeypatch.setattr(main, 'inference_admission', controller)
+    monkeypatch.setattr(main, 'get_user_id_by_email', lambda email: pytest.fail('index read before admission'))
+    with controller.slot():
+        response = client.post(route, data={'food_weight': '200'})
+    assert response.status_code == 429
+    assert 'Retry-After' in response.headers
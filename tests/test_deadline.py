@@ -0,0 +1,52 @@
+import socket
+import time
+import pytest
+from flask import Flask, g
+import deadline
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    deadline.init_deadlines(app, default_timeout=30.0)
+
+    @app.route('/socket-timeout')
+    def socket_timeout():
+        raise socket.timeout('timed out')
+
+    @app.route('/late')
+    def late():
+        g.deadline = time.monotonic() - 1
+        raise TimeoutError('timed out')
+
+    @app.route('/exceeded')
+    def exceeded():
+        g.deadline = time.monotonic() - 1
+        deadline.check()
+
+    return app
+
+
+def test_remaining_is_capped_by_the_per_call_default(app):
+    with app.test_request_context('/'):
+        g.deadline = time.monotonic() + 30
+        assert deadline.remaining(10.0) == 10.0
+        assert 29 < deadline.remaining() <= 30
+        g.deadline = time.monotonic() + 2
+        assert deadline.remaining(10.0) <= 2
+
+
+def test_remaining_outside_a_request_is_the_default():
+    assert deadline.remaining(10.0) == 10.0
+
+
+def test_backend_timeout_before_the_deadline_is_503(app):
+    response = app.test_client().get('/socket-timeout')
+    assert response.status_code == 503
+
+
+@pytest.mark.parametrize('route', ['/late', '/exceeded'])
+def test_timeout_after_the_deadline_is_504(app, route):
+    response = app.test_client().get(route)
+    assert response.status_code == 504
+    assert response.get_json()['message'] == 'Request timed out'
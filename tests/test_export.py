@@ -0,0 +1,52 @@
+import gzip
+import json
+import pytest
+import deadline
+import main
+
+
+def meals(count, error=None):
+    for i in range(count):
+        yield f'-entry{i}', {'user_id': '-NjEtLWvhlL1rak30Xwd', 'title': 'Nasi Goreng', 'calories': 350}
+    if error is not None:
+        raise error
+
+
+@pytest.fixture
+def export(monkeypatch, client, user):
+    def get(source, query=''):
+        monkeypatch.setattr(main, 'iter_user_food', lambda user_id: source)
+        return client.get('/profile/export' + query, headers=user['headers'])
+    return get
+
+
+def test_export_streams_every_row(export):
+    response = export(meals(3))
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [line['entry_id'] for line in lines] == ['-entry0', '-entry1', '-entry2']
+
+
+@pytest.mark.parametrize('error', [RuntimeError('backend down'), deadline.DeadlineExceeded('late')])
+def test_failed_export_ends_with_error_trailer(export, error):
+    response = export(meals(2, error), '?gzip=1')
+    lines = gzip.decompress(response.get_data()).decode('utf-8').splitlines()
+    assert len(lines) == 3
+    assert json.loads(lines[-1]) == {'error': 'export incomplete', 'message': 'stopped after 2 rows'}
+
+
+def test_failed_csv_export_is_cut_off(export):
+    # No CSV line marks failure, so the download itself must fail
+    with pytest.raises(RuntimeError):
+        export(meals(1, RuntimeError('backend down')), '?format=csv').get_data()
+
+
+def test_export_is_not_cut_by_the_request_deadline(export):
+    def slow_meals():
+        # Reads after the response started must not see the route's deadline
+        assert deadline.remaining('none') == 'none'
+        yield from meals(1)
+
+    response = export(slow_meals())
+    lines = response.get_data(as_text=True).splitlines()
+    assert [json.loads(line)['entry_id'] for line in lines] == ['-entry0']
@@ -0,0 +1,115 @@
+import pytest
+import main
+import utils
+
+SHA256 = 'ab' * 32
+
+
+@pytest.fixture
+def stored_meals(monkeypatch):
+    meals = []
+    monkeypatch.setattr(main, 'store_food_data', lambda user_id, image_url, *args: meals.append((user_id, image_url)))
+    monkeypatch.setattr(main, 'bump_user_version', lambda email: None)
+    return meals
+
+
+def image_ref(user_id, sha256=SHA256, extension='jpg'):
+    return f'food_images/{user_id}/{sha256}.{extension}'
+
+
+# /master/upload_url
+
+@pytest.mark.parametrize('form', [
+    {'sha256': 'not-a-hash', 'content_type': 'image/jpeg'},
+    {'sha256': SHA256[:-1], 'content_type': 'image/jpeg'},
+    {'sha256': SHA256, 'content_type': 'image/gif'},
+    {'sha256': SHA256}
+])
+def test_upload_url_rejects_bad_hash_or_content_type(client, user, bucket, form):
+    response = client.post('/master/upload_url', data=form, headers=user['headers'])
+    assert response.status_code == 400
+    assert bucket.signed == []
+
+
+def test_upload_url_is_signed_write_once_under_the_users_prefix(client, user, bucket):
+    response = client.post('/master/upload_url', data={'sha256': SHA256, 'content_type': 'image/png'}, headers=user['headers'])
+    assert response.status_code == 200
+
+    data = response.get_json()['data']
+    assert data['image_ref'] == image_ref(user['user_id'], extension='png')
+    assert data['headers']['x-goog-if-generation-match'] == '0'
+
+    name, kwargs = bucket.signed[0]
+    assert name == data['image_ref']
+    assert kwargs['method'] == 'PUT'
+    assert kwargs['headers'] == {'x-goog-if-generation-match': '0'}
+
+
+def test_upload_url_skips_upload_for_existing_blob(client, user, bucket):
+    bucket.objects[image_ref(user['user_id'])] = b'photo'
+    response = client.post('/master/upload_url', data={'sha256': SHA256, 'content_type': 'image/jpeg'}, headers=user['headers'])
+    assert response.status_code == 200
+    assert response.get_json()['data'] == {'image_ref': image_ref(user['user_id']), 'upload_url': None}
+    assert bucket.signed == []
+
+
+def test_upload_url_requires_token(client, bucket):
+    response = client.post('/master/upload_url', data={'sha256': SHA256, 'content_type': 'image/jpeg'})
+    assert response.status_code == 401
+
+
+# get_uploaded_image_url
+
+@pytest.mark.parametrize('ref', [
+    '',
+    'food_images/other-user/' + SHA256 + '.jpg',
+    'food_images/' + SHA256 + '.jpg',
+    'food_images/-NjEtLWvhlL1rak30Xwd/' + SHA256 + '.gif',
+    'food_images/-NjEtLWvhlL1rak30Xwd/../' + SHA256 + '.jpg',
+    'image.jpg'
+])
+def test_get_uploaded_image_url_rejects_foreign_refs(bucket, ref):
+    bucket.objects[ref] = b'photo'
+    assert utils.get_uploaded_image_url(ref, '-NjEtLWvhlL1rak30Xwd') is None
+
+
+def test_get_uploaded_image_url_missing_blob(bucket):
+    assert utils.get_uploaded_image_url(image_ref('-NjEtLWvhlL1rak30Xwd'), '-NjEtLWvhlL1rak30Xwd') is None
+
+
+def test_get_uploaded_image_url_existing_blob(bucket):
+    ref = image_ref('-NjEtLWvhlL1rak30Xwd')
+    bucket.objects[ref] = b'photo'
+    assert utils.get_uploaded_image_url(ref, '-NjEtLWvhlL1rak30Xwd') == f'https://storage.googleapis.com/test-bucket/{ref}'
+
+
+# submit_manual / submit_food with image_ref
+
+MANUAL_FORM = {'name': 'Nasi Goreng', 'weight': '200', 'calories': '350'}
+FOOD_FORM = {
+    'food[0][name]': 'Nasi Goreng',
+    'food[0][weight]': '200',
+    'food[0][protein]': '8',
+    'food[0][fat]': '12',
+    'food[0][carb]': '50'
+}
+
+
+@pytest.mark.parametrize('route, form', [('/master/submit_manual', MANUAL_FORM), ('/master/submit_food', FOOD_FORM)])
+def test_submit_with_uploaded_image_ref(client, user, bucket, stored_meals, route, form):
+    ref = image_ref(user['user_id'])
+    bucket.objects[ref] = b'photo'
+    response = client.post(route, data=dict(form, image_ref=ref), headers=user['headers'])
+    assert response.status_code == 200
+    assert stored_meals == [(user['user_id'], f'https://storage.googleapis.com/test-bucket/{ref}')]
+
+
+@pytest.mark.parametrize('route, form', [('/master/submit_manual', MANUAL_FORM), ('/master/submit_food', FOOD_FORM)])
+@pytest.mark.parametrize('ref', [image_ref('-NjEtLWvhlL1rak30Xwd'), image_ref('someone-else'), 'food_images/image.jpg'])
+def test_submit_with_missing_or_foreign_image_ref(client, user, bucket, stored_meals, route, form, ref):
+    # Only someone else's photo exists
+    bucket.objects[image_ref('someone-else')] = b'photo'
+    response = client.post(route, data=dict(form, image_ref=ref), headers=user['headers'])
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'Image not uploaded!'
+    assert stored_meals == []
@@ -0,0 +1,36 @@
+import types
+import import_data
+from utils import get_date_from_timestamp, hash_email
+
+MEAL = {
+    'user_id': '-NjEtLWvhlL1rak30Xwd',
+    'title': 'Nasi Goreng',
+    'category': 'breakfast',
+    'calories': 350,
+    'proteins': 8,
+    'fats': 12,
+    'carbs': 50,
+    'timestamp': '2024-03-02T06:30:00+07:00'
+}
+
+
+def test_meal_timestamp_with_offset_is_stored_as_naive_utc():
+    updates, _ = import_data.meal_updates(MEAL, 1)
+    entry = next(iter(updates.values()))
+    assert entry['timestamp'] == '2024-03-01T23:30:00'
+    # The dashboard reads it back on the day it was eaten in WIB
+    assert get_date_from_timestamp(entry['timestamp']) == '2024-03-02'
+
+
+def test_flush_bumps_versions_of_every_user_touched(monkeypatch):
+    written = {}
+    users = {'users/-NjEtLWvhlL1rak30Xwd': {'email': 'siti@example.com'}}
+    monkeypatch.setattr(import_data.db, 'reference', lambda path='/': types.SimpleNamespace(
+        get=lambda: users.get(path), update=written.update))
+
+    updates, _ = import_data.meal_updates(MEAL, 1)
+    emails = {}
+    import_data.flush([{'line': 1, 'row': MEAL, 'updates': updates, 'user': None}], False, emails)
+
+    assert written[f'user_versions/{hash_email("siti@example.com")}'] == {'.sv': {'increment': 1}}
+    assert emails == {'-NjEtLWvhlL1rak30Xwd': 'siti@example.com'}
@@ -0,0 +1,29 @@
+import inference
+from inference import ModelManager
+
+
+def test_model_manager_passes_thread_count_to_tflite_interpreters(tmp_path, monkeypatch):
+    created = []
+
+    class FakeInterpreter:
+        def __init__(self, model_path=None, model_content=None, num_threads=None):
+            created.append(num_threads)
+
+        def allocate_tensors(self):
+            pass
+
+        def get_input_details(self):
+            return [{'index': 0}]
+
+        def get_output_details(self):
+            return [{'index': 1}]
+
+    model_path = tmp_path / 'model.tflite'
+    model_path.write_bytes(b'tflite')
+    monkeypatch.setattr(inference.tf.lite, 'Interpreter', FakeInterpreter)
+    monkeypatch.setattr(inference, 'warm_up', lambda model: None)
+
+    manager = ModelManager(str(model_path), pool_size=2, poll_interval=0, num_threads=3)
+    manager.preload()
+    manager.load()
+    assert created == [3, 3]
@@ -0,0 +1,67 @@
+import types
+import pytest
+from google.api_core.exceptions import PreconditionFailed
+import meal_archive
+
+USER_ID = '-NjEtLWvhlL1rak30Xwd'
+
+
+def test_iter_user_food_streams_archive_then_hot_entries(monkeypatch):
+    archived = {
+        '2024-01': {'-a1': {'user_id': USER_ID, 'timestamp': '2024-01-05T08:00:00+07:00', 'title': 'archived'}},
+        '2024-02': {'-b1': {'user_id': USER_ID, 'timestamp': '2024-02-05T08:00:00+07:00', 'title': 'archived'},
+                    '-b2': {'user_id': USER_ID, 'timestamp': '2024-02-06T08:00:00+07:00', 'title': 'archived'}}
+    }
+    hot = {
+        # Archived meanwhile: the hot copy wins and comes last
+        '-b2': {'user_id': USER_ID, 'timestamp': '2024-02-06T08:00:00+07:00', 'title': 'hot'},
+        '-c1': {'user_id': USER_ID, 'timestamp': '2024-03-01T08:00:00+07:00', 'title': 'hot'},
+        '-x1': {'user_id': 'someone-else', 'timestamp': '2024-03-01T08:00:00+07:00', 'title': 'hot'}
+    }
+    monkeypatch.setattr(meal_archive, 'query_equal_to', lambda path, child, value: hot)
+    monkeypatch.setattr(meal_archive, 'get_archive_summaries', lambda user_id: {month: {} for month in archived})
+    monkeypatch.setattr(meal_archive, 'load_archived_month', lambda user_id, month: archived[month])
+
+    meals = list(meal_archive.iter_user_food(USER_ID))
+    assert [(key, entry['title']) for key, entry in meals] == [
+        ('-a1', 'archived'), ('-b1', 'archived'), ('-b2', 'hot'), ('-c1', 'hot')
+    ]
+    assert list(meal_archive.get_user_food(USER_ID, '2024-02', '2024-02')) == ['-b1', '-b2']
+
+
+MEAL = {'user_id': USER_ID, 'timestamp': '2024-01-05T01:00:00', 'title': 'Nasi Goreng',
+        'calories': 350, 'proteins': 8, 'fats': 12, 'carbs': 50, 'category': 'breakfast'}
+
+
+@pytest.fixture
+def summaries(monkeypatch):
+    written = {}
+    monkeypatch.setattr(meal_archive.db, 'reference', lambda path='/': types.SimpleNamespace(update=written.update))
+    return written
+
+
+def test_archive_month_merges_a_file_left_without_summary(bucket, summaries):
+    # A crashed run uploaded the file but never wrote the summary
+    blob_name = meal_archive.archive_blob_name(USER_ID, '2024-01')
+    bucket.blob(blob_name).upload_from_string(meal_archive.encode_entries({'-a1': MEAL}))
+
+    meal_archive.archive_month(USER_ID, '2024-01', {'-a2': MEAL})
+    assert set(meal_archive.decode_entries(bucket.objects[blob_name])) == {'-a1', '-a2'}
+    assert summaries[f'{meal_archive.ARCHIVE_PATH}/{USER_ID}/2024-01']['entries'] == 2
+
+
+def test_archive_month_never_overwrites_a_file_written_concurrently(bucket, summaries, monkeypatch):
+    blob_name = meal_archive.archive_blob_name(USER_ID, '2024-01')
+    original_get_blob = bucket.get_blob
+
+    def get_blob_then_race(name):
+        found = original_get_blob(name)
+        # Another run creates the file between this run's read and its upload
+        bucket.blob(name).upload_from_string(meal_archive.encode_entries({'-other': MEAL}))
+        return found
+
+    monkeypatch.setattr(bucket, 'get_blob', get_blob_then_race)
+    with pytest.raises(PreconditionFailed):
+        meal_archive.archive_month(USER_ID, '2024-01', {'-a2': MEAL})
+    assert set(meal_archive.decode_entries(bucket.objects[blob_name])) == {'-other'}
+    assert summaries == {}
@@ -0,0 +1,59 @@
+import time
+import pytest
+import migrate_email_index
+from utils import generate_push_id, hash_email
+
+
+class FakeRef:
+    def __init__(self, store, path):
+        self.store = store
+        self.path = path
+
+    def get(self):
+        node = self.store
+        for part in self.path.split('/'):
+            node = (node or {}).get(part)
+        return node
+
+    def transaction(self, fn):
+        parent, key = self.path.rsplit('/', 1)
+        value = fn(self.store[parent].get(key))
+        if value is None:
+            self.store[parent].pop(key, None)
+        else:
+            self.store[parent][key] = value
+        return value
+
+    def update(self, values):
+        for key, value in values.items():
+            self.store.setdefault(self.path, {})[key] = value
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = {'users': {}, 'users_by_email': {}}
+    monkeypatch.setattr(migrate_email_index.db, 'reference', lambda path: FakeRef(store, path))
+    return store
+
+
+def test_fix_keeps_entries_of_users_registered_during_the_check(store, monkeypatch):
+    old_user = generate_push_id(int(time.time() * 1000) - 60000, 'old')
+    store['users'][old_user] = {'email': 'old@example.com'}
+    store['users_by_email'] = {hash_email('old@example.com'): old_user, hash_email('gone@example.com'): 'deleted-user'}
+
+    def iter_children(path, page_size):
+        if path == 'users_by_email':
+            # Registered after the users scan, before the index scan
+            new_user = generate_push_id(int(time.time() * 1000) + 1000, 'new')
+            store['users'][new_user] = {'email': 'new@example.com'}
+            store['users_by_email'][hash_email('new@example.com')] = new_user
+            # Registered before the check started, missed by the users scan all the same
+            late_user = generate_push_id(int(time.time() * 1000) - 1000, 'late')
+            store['users'][late_user] = {'email': 'late@example.com'}
+            store['users_by_email'][hash_email('late@example.com')] = late_user
+        return list(store[path].items())
+
+    monkeypatch.setattr(migrate_email_index, 'iter_children', iter_children)
+    migrate_email_index.check(1000, fix=True)
+
+    assert set(store['users_by_email']) == {hash_email(email) for email in ('old@example.com', 'new@example.com', 'late@example.com')}
@@ -0,0 +1,51 @@
+from concurrent.futures import ThreadPoolExecutor
+import types
+import pytest
+import main
+import utils
+
+FORM = {
+    'fullname': 'Siti Rahmawati',
+    'birthday': '1998-04-12',
+    'email': 'siti@example.com',
+    'password': 'secret123',
+    'height': '158',
+    'weight': '54',
+    'gender': 'F',
+    'activity_level': 'M'
+}
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    calls = []
+
+    class Ref:
+        def __init__(self, path):
+            self.path = path
+
+        def update(self, value):
+            calls.append(('update', self.path, value))
+
+        def transaction(self, fn):
+            calls.append(('transaction', self.path))
+            return fn(None)
+
+    monkeypatch.setattr(utils.db, 'reference', lambda path='/': Ref(path))
+    monkeypatch.setattr(main.auth, 'create_user', lambda **kwargs: types.SimpleNamespace(uid=kwargs['uid']))
+    monkeypatch.setattr(main, 'auth_executor', ThreadPoolExecutor(max_workers=1))
+    return calls
+
+
+def test_register_writes_records_and_version_in_one_update(client, backend):
+    response = client.post('/auth/register', data=FORM)
+    assert response.status_code == 201
+
+    # The email index claim, then a single multi-path update
+    assert [call[0] for call in backend] == ['transaction', 'update']
+    updates = backend[1][2]
+    user_id = next(key.split('/', 1)[1] for key in updates if key.startswith('users/'))
+    assert backend[0][1] == 'users_by_email/' + utils.hash_email(FORM['email'])
+    assert set(updates) == {'users/' + user_id, 'body_measurements/' + user_id, 'profiles/' + user_id,
+                            'user_versions/' + utils.hash_email(FORM['email'])}
+    assert updates['user_versions/' + utils.hash_email(FORM['email'])] == {'.sv': {'increment': 1}}
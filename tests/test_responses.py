@@ -0,0 +1,10 @@
+import main
+
+
+def test_json_responses_are_compact(client, user, monkeypatch):
+    monkeypatch.setattr(main, 'get_user_version', lambda email: 0)
+    monkeypatch.setattr(main, 'get_user_profile', lambda user_id: main.build_user_profile(
+        'Siti', '1998-04-12', user['email'], 158, 54, 'F', 'M'))
+    response = client.get('/profile', headers=user['headers'])
+    assert response.status_code == 200
+    assert b'\n' not in response.get_data().rstrip(b'\n')
@@ -0,0 +1,31 @@
+import pytest
+import runtime_config
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    def set_limits(cpu_limit, memory_limit_mb=None, **overrides):
+        monkeypatch.setattr(runtime_config, 'read_cpu_limit', lambda: cpu_limit)
+        monkeypatch.setattr(runtime_config, 'read_memory_limit_mb', lambda: memory_limit_mb)
+        monkeypatch.setattr(runtime_config, 'get_config', lambda name, default=None: overrides.get(name, default))
+        runtime_config.get_runtime_config.cache_clear()
+        return runtime_config.get_runtime_config()
+    yield set_limits
+    runtime_config.get_runtime_config.cache_clear()
+
+
+@pytest.mark.parametrize('cpu_limit, workers, concurrency, intra_op', [
+    (1, 1, 1, 1),
+    (4, 1, 2, 2),
+    (8, 2, 2, 2),
+    (3, 1, 2, 1)
+])
+def test_concurrent_predictions_share_the_worker_cpus(limits, cpu_limit, workers, concurrency, intra_op):
+    runtime = limits(cpu_limit, GUNICORN_WORKERS=workers)
+    assert (runtime.inference_concurrency, runtime.tf_intra_op_threads) == (concurrency, intra_op)
+    assert runtime.inference_concurrency * runtime.tf_intra_op_threads <= max(1, cpu_limit // workers)
+
+
+def test_intra_op_override_wins(limits):
+    runtime = limits(4, GUNICORN_WORKERS=1, TF_INTRA_OP_THREADS=4)
+    assert runtime.tf_intra_op_threads == 4
@@ -0,0 +1,98 @@
+import hashlib
+import io
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pytest
+from PIL import Image
+import main
+import utils
+from inference import ActiveModel
+
+CLASS_COUNT = 16
+
+
+def make_photo():
+    buffer = io.BytesIO()
+    Image.fromarray(np.random.default_rng(0).integers(0, 255, (64, 64, 3), dtype=np.uint8)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class FakeModel:
+    def __init__(self, scores):
+        self.scores = np.array([scores], dtype=np.float32)
+
+    def predict(self, images, batch_size=1):
+        return self.scores
+
+
+@pytest.fixture
+def stored_urls():
+    # image_url of every meal already in the database
+    return set()
+
+
+@pytest.fixture
+def scan(monkeypatch, client, user, bucket, stored_urls):
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(main, 'upload_executor', executor)
+    monkeypatch.setattr(main.image_gate, 'check', lambda data: None)
+    monkeypatch.setattr(main, 'bump_user_version', lambda email: None)
+    monkeypatch.setattr(main, 'store_food_data', lambda user_id, image_url, *args: 'entry-1')
+    monkeypatch.setattr(utils, 'image_referenced', lambda user_id, image_url: image_url in stored_urls)
+
+    def post(scores, photo=None):
+        monkeypatch.setattr(main.model_manager, 'active', ActiveModel(FakeModel(scores), 'test', 0))
+        data = {'food_weight': '200', 'food_image': (io.BytesIO(photo or make_photo()), 'image.jpg', 'image/png')}
+        try:
+            return client.post('/master/scan_and_submit', data=data, headers=user['headers'])
+        finally:
+            # Upload done-callbacks have run once the worker thread is joined
+            executor.shutdown(wait=True)
+
+    return post
+
+
+def photo_ref(user_id, photo):
+    return f'food_images/{user_id}/{hashlib.sha256(photo).hexdigest()}.png'
+
+
+def test_upload_uses_content_address_not_client_filename(scan, user, bucket, monkeypatch):
+    monkeypatch.setattr(main, 'get_foods_nutrition', lambda labels, weight: [])
+    photo = make_photo()
+    response = scan([0.9] + [0.0] * (CLASS_COUNT - 1), photo)
+    assert response.status_code == 200
+    assert list(bucket.objects) == [photo_ref(user['user_id'], photo)]
+
+
+def test_failed_scan_discards_the_new_upload(scan, bucket):
+    response = scan([0.0] * CLASS_COUNT)
+    assert response.status_code == 401
+    assert bucket.objects == {}
+
+
+def test_failed_scan_keeps_a_photo_stored_before(scan, user, bucket):
+    photo = make_photo()
+    bucket.objects[photo_ref(user['user_id'], photo)] = photo
+    response = scan([0.0] * CLASS_COUNT, photo)
+    assert response.status_code == 401
+    assert list(bucket.objects) == [photo_ref(user['user_id'], photo)]
+
+
+def test_error_after_inference_discards_the_new_upload(scan, bucket, monkeypatch):
+    def missing_nutrients(labels, weight):
+        raise RuntimeError('food_nutrients entry missing')
+
+    monkeypatch.setattr(main, 'get_foods_nutrition', missing_nutrients)
+    with pytest.raises(RuntimeError):
+        scan([0.9] + [0.0] * (CLASS_COUNT - 1))
+    assert bucket.objects == {}
+
+
+def test_failed_scan_keeps_a_new_upload_another_meal_references(scan, user, bucket, stored_urls):
+    # A concurrent scan of the same photo stored its meal before this one failed
+    photo = make_photo()
+    ref = photo_ref(user['user_id'], photo)
+    stored_urls.add(bucket.blob(ref).public_url)
+    response = scan([0.0] * CLASS_COUNT, photo)
+    assert response.status_code == 401
+    assert list(bucket.objects) == [ref]
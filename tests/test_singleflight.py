@@ -0,0 +1,58 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import pytest
+from singleflight import SingleFlight
+
+
+def test_uncontended_call_returns_the_result_uncopied():
+    reads = SingleFlight()
+    fetched = {'profile': {'weight': 54}}
+    assert reads.do('profiles/a', lambda: fetched) is fetched
+
+
+def test_followers_copy_a_snapshot_the_leader_cannot_mutate():
+    reads = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    fetched = {'profile': {'weight': 54}}
+
+    def fetch():
+        started.set()
+        release.wait(5)
+        return fetched
+
+    def lead():
+        # Mutates straight away, as update_user_profile does
+        result = reads.do('profiles/a', fetch)
+        result['profile']['weight'] = 60
+        return result
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(lead)
+        started.wait(5)
+        follower = executor.submit(reads.do, 'profiles/a', fetch)
+        while reads.shared == 0:
+            time.sleep(0.001)
+        release.set()
+        assert leader.result(5) is fetched
+        assert follower.result(5) == {'profile': {'weight': 54}}
+
+
+def test_follower_gives_up_after_timeout():
+    reads = SingleFlight()
+    release = threading.Event()
+    started = threading.Event()
+
+    def fetch():
+        started.set()
+        release.wait(5)
+        return 'value'
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        leader = executor.submit(reads.do, 'profiles/a', fetch)
+        started.wait(5)
+        with pytest.raises(TimeoutError):
+            reads.do('profiles/a', fetch, timeout=0.01)
+        release.set()
+        assert leader.result(5) == 'value'
@@ -0,0 +1,65 @@
+import types
+import pytest
+import main
+import utils
+from conftest import SECRET_KEY
+
+
+@pytest.fixture
+def unindexed(monkeypatch, client):
+    # A valid token for an email the users_by_email index does not know
+    monkeypatch.setattr(main, 'get_user_id_by_email', lambda email: None)
+    monkeypatch.setattr(main, 'get_user_version', lambda email: 0)
+    monkeypatch.setattr(main, 'get_user_profile', lambda user_id: pytest.fail('profile read for a missing user'))
+    token = utils.create_access_token_with_claims('lost@example.com', SECRET_KEY)
+    return {'Authorization': f'Bearer {token}'}
+
+
+@pytest.mark.parametrize('route', ['/profile', '/master/dashboard'])
+def test_unindexed_user_is_not_found(client, unindexed, route):
+    response = client.get(route, headers=unindexed)
+    assert response.status_code == 404
+    assert response.get_json()['message'] == 'User not found in the database'
+
+
+def test_login_of_unindexed_user_is_not_found(client, unindexed, monkeypatch):
+    signed_in = types.SimpleNamespace(status_code=200, json=lambda: {'localId': 'auth-uid'})
+    monkeypatch.setattr(main.requests, 'post', lambda *args, **kwargs: signed_in)
+    response = client.post('/auth/login', data={'email': 'lost@example.com', 'password': 'secret123'})
+    assert response.status_code == 404
+    assert response.get_json()['data'] is None
+
+
+@pytest.fixture
+def profile(monkeypatch, client, user):
+    monkeypatch.setattr(main, 'get_user_version', lambda email: 0)
+
+    def set_profile(value):
+        monkeypatch.setattr(main, 'get_user_profile', lambda user_id: value)
+    return set_profile
+
+
+@pytest.mark.parametrize('route', ['/profile', '/master/dashboard'])
+def test_missing_profile_is_not_found(client, user, profile, route):
+    profile(None)
+    response = client.get(route, headers=user['headers'])
+    assert response.status_code == 404
+    assert response.get_json() == {'status': False, 'message': 'User profile not found', 'data': None}
+
+
+def test_login_without_profile_is_not_found(client, user, profile, monkeypatch):
+    profile(None)
+    signed_in = types.SimpleNamespace(status_code=200, json=lambda: {'localId': user['user_id']})
+    monkeypatch.setattr(main.requests, 'post', lambda *args, **kwargs: signed_in)
+    response = client.post('/auth/login', data={'email': user['email'], 'password': 'secret123'})
+    assert response.status_code == 404
+
+
+def test_dashboard_without_targets_is_a_json_500(client, user, profile):
+    stored = utils.build_user_profile('Siti', '1998-04-12', user['email'], 158, 54, 'F', 'M')
+    # RTDB drops a null field, so targets is missing rather than None
+    del stored['targets']
+    profile(stored)
+    response = client.get('/master/dashboard', headers=user['headers'])
+    assert response.status_code == 500
+    assert response.get_json() == {'status': False, 'message': 'Failed to calculate calories needed', 'data': None}
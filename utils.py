@@ -1,11 +1,59 @@
+import os
 import re
 import datetime
+import hashlib
 import pytz
 import jwt
 import requests
-from datetime import datetime
+from datetime import datetime, timedelta
+from urllib.parse import unquote, urlparse
+from flask import request, make_response
+import config
+import firebase_admin
 from config import FIREBASE_AUTH_API
-from firebase_admin import db, auth, storage, initialize_app
+from firebase_admin import credentials, db, auth, storage, initialize_app
+from google.api_core.exceptions import PreconditionFailed
+from singleflight import SingleFlight
+import deadline
+
+FIREBASE_OPTIONS = {
+    'databaseURL': 'https://capstone-project-nutrimatch-default-rtdb.asia-southeast1.firebasedatabase.app/',
+    'storageBucket': 'capstone-project-nutrimatch.appspot.com'
+}
+
+# Concurrent identical reads share one backend request
+reads = SingleFlight()
+
+def read_node(path):
+    return reads.do(path, lambda: db.reference(path).get(), deadline.remaining(BACKEND_TIMEOUT))
+
+def query_equal_to(path, child, value):
+    return reads.do(f'{path}?{child}={value}', lambda: db.reference(path).order_by_child(child).equal_to(value).get(),
+                    deadline.remaining(BACKEND_TIMEOUT))
+
+def init_firebase():
+    try:
+        return firebase_admin.get_app()
+    except ValueError:
+        cred = credentials.Certificate('serviceAccountKey1.json')
+        # The Admin SDK takes one timeout for every Realtime Database and Auth call
+        return initialize_app(cred, dict(FIREBASE_OPTIONS, httpTimeout=BACKEND_TIMEOUT))
+
+def get_config(name, default=None):
+    # Environment variables win over config.py so a deploy can be tuned without a rebuild
+    value = os.environ.get(name)
+    if value is None:
+        return getattr(config, name, default)
+    if isinstance(default, bool):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    if isinstance(default, int):
+        return int(value)
+    if isinstance(default, float):
+        return float(value)
+    return value
+
+# Seconds any single backend call may take, and the budget used outside a request
+BACKEND_TIMEOUT = get_config('BACKEND_TIMEOUT', 10.0)
 
 def is_valid_email(email):
     pattern = r'^[\w\.-]+@[\w\.-]+\.\w+$'
@@ -70,13 +118,13 @@ def calculate_calories_needed(weight, height, age, gender, activity_level):
     return calories_needed
 
 def get_nutrition_info(label):
-    ref = db.reference('food_nutrients/' + label)
-    foods = ref.get()
+    foods = read_node('food_nutrients/' + label)
     return foods
 
+CLASS_LABELS = ["ayam", "nasi", "telur", "brokoli", "ikan", "jeruk", "mie", "roti", "tahu", "tempe"]
+
 def get_class_labels(class_indices):
-    class_labels = ["ayam", "nasi", "telur", "brokoli", "ikan", "jeruk", "mie", "roti", "tahu", "tempe"]
-    return [class_labels[idx] for idx in class_indices]
+    return [CLASS_LABELS[idx] for idx in class_indices]
 
 def categorize_meal():
     jakarta_timezone = pytz.timezone('Asia/Jakarta')
@@ -97,7 +145,7 @@ def store_food_data(user_id, image_url, meal_category, calories, proteins, fats,
 
     timestamp = datetime.now().isoformat()
 
-    new_food_entry.set({
+    food_entry = {
         'user_id': user_id,
         'title': food_title,
         'image_url': image_url,
@@ -107,24 +155,131 @@ def store_food_data(user_id, image_url, meal_category, calories, proteins, fats,
         'fats': fats,
         'carbs': carbs,
         'timestamp': timestamp
-    })
+    }
 
+    # Foods are written in the same request as the entry
     for index, label_info in enumerate(foods):
-        food_entry = new_food_entry.child(f'food_{index}')
-        food_entry.set(label_info)
+        food_entry[f'food_{index}'] = label_info
+
+    deadline.check()
+    new_food_entry.set(food_entry)
+    reads.forget(f'user_food?user_id={user_id}')
+    return new_food_entry.key
 
 def upload_food_image(file):
     bucket = storage.bucket()
 
     file_name = file.filename
     blob = bucket.blob(file_name)
-    blob.upload_from_file(file)
+    blob.upload_from_file(file, timeout=deadline.remaining(BACKEND_TIMEOUT))
     
     # Return the public URL of the uploaded image
     image_url = blob.public_url
     
     return image_url
 
+IMAGE_CONTENT_TYPES = {
+    'image/jpeg': 'jpg',
+    'image/png': 'png',
+    'image/webp': 'webp'
+}
+
+# Signed into every upload URL and sent by the client: the PUT only succeeds
+# if the object does not exist yet, so a stored photo is never overwritten
+UPLOAD_PRECONDITION_HEADERS = {'x-goog-if-generation-match': '0'}
+
+def image_ref_for(user_id, sha256, extension):
+    # Content-addressed per user, so one user's upload can never replace another's photo
+    return f'food_images/{user_id}/{sha256}.{extension}'
+
+def create_image_upload_url(user_id, sha256, content_type, md5=None, expires_in=300):
+    # Returns (image_ref, None) when this user already uploaded the same photo
+    image_ref = image_ref_for(user_id, sha256, IMAGE_CONTENT_TYPES[content_type])
+    blob = storage.bucket().blob(image_ref)
+    if blob.exists(timeout=deadline.remaining(BACKEND_TIMEOUT)):
+        return image_ref, None
+    upload_url = blob.generate_signed_url(
+        version='v4',
+        expiration=timedelta(seconds=expires_in),
+        method='PUT',
+        content_type=content_type,
+        # With an MD5 the bucket rejects any body that does not match it
+        content_md5=md5,
+        headers=UPLOAD_PRECONDITION_HEADERS
+    )
+    return image_ref, upload_url
+
+def get_uploaded_image_url(image_ref, user_id):
+    # None unless the reference is one we handed this user and the upload finished
+    pattern = rf'^food_images/{re.escape(user_id)}/[0-9a-f]{{64}}\.(jpg|png|webp)$'
+    if not image_ref or not re.match(pattern, image_ref):
+        return None
+    blob = storage.bucket().blob(image_ref)
+    if not blob.exists(timeout=deadline.remaining(BACKEND_TIMEOUT)):
+        return None
+    return blob.public_url
+
+def blob_name_from_url(image_url):
+    # https://storage.googleapis.com/<bucket>/<quoted blob name> -> blob name
+    if not image_url:
+        return None
+    path = urlparse(image_url).path.lstrip('/')
+    if '/' not in path:
+        return None
+    return unquote(path.split('/', 1)[1])
+
+def upload_food_image_data(data, image_ref, content_type=None, timeout=BACKEND_TIMEOUT):
+    # Same as upload_food_image for an upload that was already read into memory.
+    # Runs on a worker thread, so the caller passes the request's remaining budget.
+    # Returns (blob, created); created is False when the photo was stored before.
+    blob = storage.bucket().blob(image_ref)
+    try:
+        blob.upload_from_string(data, content_type=content_type, timeout=timeout, if_generation_match=0)
+    except PreconditionFailed:
+        return blob, False
+    return blob, True
+
+def image_referenced(user_id, image_url):
+    # Read directly, a shared read started before a meal was stored could miss it
+    meals = db.reference('user_food').order_by_child('user_id').equal_to(user_id).get() or {}
+    return any(entry.get('image_url') == image_url for entry in meals.values() if entry)
+
+def discard_uploaded_image(upload, user_id):
+    # Done-callback for an upload future whose image ended up unused; a blob
+    # that existed before this request may be referenced by other meals
+    if upload.exception() is None:
+        blob, created = upload.result()
+        if created:
+            try:
+                # Same photo, same name: a concurrent request may have stored a meal with it
+                if not image_referenced(user_id, blob.public_url):
+                    blob.delete()
+            except Exception:
+                pass
+
+def get_foods_nutrition(class_labels, food_weight):
+    # Split the weight evenly between detected labels and scale their per-gram nutrients
+    foods = []
+    for label in class_labels:
+        nutrition = get_nutrition_info(label)
+        weight = round(food_weight / len(class_labels), 2)
+
+        protein = round(nutrition['prot'] * weight, 2)
+        fat = round(nutrition['fat'] * weight, 2)
+        carb = round(nutrition['carbs'] * weight, 2)
+
+        label_info = {
+            'food_title': label,
+            'nutrition_info': {
+                'weight': weight,
+                'protein': protein,
+                'fat': fat,
+                'carb': carb
+            }
+        }
+        foods.append(label_info)
+    return foods
+
 def get_date_from_timestamp(timestamp):
     if timestamp is None:
         return None
@@ -144,10 +299,246 @@ def verify_old_password(email, password):
         'returnSecureToken': False
     }
 
-    response = requests.post(FIREBASE_AUTH_API, json=request_data)
+    response = requests.post(FIREBASE_AUTH_API, json=request_data, timeout=deadline.remaining(BACKEND_TIMEOUT))
     response_data = response.json()
 
     if 'idToken' in response_data:
         return True
     else:
         return False
+
+def hash_email(email):
+    normalized = email.strip().lower()
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+def get_user_version(email):
+    # Version counter of everything rendered for this user (profile, dashboard)
+    version = read_node('user_versions/' + hash_email(email))
+    return version or 0
+
+def bump_user_version(email):
+    # Must be called after the write it covers, so an ETag never outlives its data
+    version_ref = db.reference('user_versions/' + hash_email(email))
+    version_ref.transaction(lambda current: (current or 0) + 1)
+    reads.forget('user_versions/' + hash_email(email))
+
+def make_etag(resource, email, version, *parts):
+    tag = f'{resource}-{hash_email(email)[:16]}-{version}'
+    for part in parts:
+        tag += f'-{part}'
+    return tag
+
+# Compressed responses carry the ETag with the encoding appended (see responses.py)
+ETAG_ENCODING_SUFFIXES = ('', '-br', '-gzip')
+
+def etag_matches(etag):
+    return any(request.if_none_match.contains(etag + suffix) for suffix in ETAG_ENCODING_SUFFIXES)
+
+def not_modified(etag):
+    # Echo the variant the client holds
+    for suffix in ETAG_ENCODING_SUFFIXES:
+        if request.if_none_match.contains(etag + suffix):
+            etag += suffix
+            break
+    response = make_response('', 304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def with_etag(response, etag):
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def get_next_birthday(birthday):
+    birth_date = datetime.strptime(birthday, '%Y-%m-%d').date()
+    today = datetime.today().date()
+    for year in (today.year, today.year + 1):
+        try:
+            next_birthday = birth_date.replace(year=year)
+        except ValueError:
+            # 29 February in a non-leap year
+            next_birthday = birth_date.replace(year=year, month=3, day=1)
+        if next_birthday > today:
+            return next_birthday.isoformat()
+
+def calculate_targets(birthday, height, weight, gender, activity_level):
+    calories_needed = calculate_calories_needed(weight, height, calculate_age(birthday), gender, activity_level)
+    if calories_needed is None:
+        return None
+
+    # (protein: 10-35% calorie, fat: 20-35%, carbs: 45-65%)
+    calories_needed = round(calories_needed, 2)
+    return {
+        'calories': calories_needed,
+        'protein': round(calories_needed * 0.2 / 4, 2),
+        'fat': round(calories_needed * 0.3 / 9, 2),
+        'carbs': round(calories_needed * 0.5 / 4, 2),
+        # Age, and with it the targets, changes on the next birthday
+        'valid_until': get_next_birthday(birthday)
+    }
+
+def build_user_profile(fullname, birthday, email, height, weight, gender, activity_level):
+    return {
+        'fullname': fullname,
+        'birthday': birthday,
+        'email': email,
+        'body_measurement': {
+            'height': height,
+            'weight': weight,
+            'activity_level': activity_level,
+            'gender': gender
+        },
+        'targets': calculate_targets(birthday, height, weight, gender, activity_level)
+    }
+
+def save_user_profile(user_id, profile):
+    db.reference('profiles/' + user_id).set(profile)
+    reads.forget('profiles/' + user_id)
+
+def create_user_records(user_id, profile):
+    # users, body_measurements and profiles of a new account in one multi-path update, which also
+    # bumps the email's version server-side so ETags of a previous account with this email go stale
+    version_path = 'user_versions/' + hash_email(profile['email'])
+    db.reference().update({
+        'users/' + user_id: {
+            'fullname': profile['fullname'],
+            'birthday': profile['birthday'],
+            'email': profile['email']
+        },
+        'body_measurements/' + user_id: dict(profile['body_measurement'], user_id=user_id),
+        'profiles/' + user_id: profile,
+        version_path: {'.sv': {'increment': 1}}
+    })
+    forget_user_records(user_id)
+    reads.forget(version_path)
+
+def delete_user_records(user_id):
+    db.reference().update({
+        'users/' + user_id: None,
+        'body_measurements/' + user_id: None,
+        'profiles/' + user_id: None
+    })
+    forget_user_records(user_id)
+
+def forget_user_records(user_id):
+    reads.forget('users/' + user_id)
+    reads.forget('profiles/' + user_id)
+    reads.forget(f'body_measurements?user_id={user_id}')
+
+def discard_created_user(creation):
+    # Done-callback for an auth.create_user future whose registration was rolled back
+    if creation.exception() is None:
+        try:
+            auth.delete_user(creation.result().uid)
+        except Exception:
+            pass
+
+def get_user_profile(user_id):
+    # One keyed read of profiles/<user_id>; users and body_measurements stay the source of truth
+    profile = read_node('profiles/' + user_id)
+
+    # Accounts registered before profiles existed are backfilled on first read
+    if profile is None:
+        user = read_node('users/' + user_id)
+        measurements = query_equal_to('body_measurements', 'user_id', user_id)
+        if not user or not measurements:
+            return None
+        measurement = measurements[list(measurements.keys())[0]]
+        profile = build_user_profile(user['fullname'], user['birthday'], user['email'], measurement['height'],
+                                     measurement['weight'], measurement['gender'], measurement['activity_level'])
+        save_user_profile(user_id, profile)
+
+    # Targets expire on the user's birthday
+    targets = profile.get('targets')
+    if targets and targets['valid_until'] <= datetime.today().date().isoformat():
+        body = profile['body_measurement']
+        profile['targets'] = calculate_targets(profile['birthday'], body['height'], body['weight'],
+                                               body['gender'], body['activity_level'])
+        db.reference('profiles/' + user_id).update({'targets': profile['targets']})
+        reads.forget('profiles/' + user_id)
+
+    return profile
+
+def update_user_profile(user_id, fullname=None, birthday=None, body_measurement=None, profile=None):
+    if profile is None:
+        profile = get_user_profile(user_id)
+    if profile is None:
+        return None
+
+    if fullname is not None:
+        profile['fullname'] = fullname
+    if birthday is not None:
+        profile['birthday'] = birthday
+    if body_measurement is not None:
+        profile['body_measurement'] = body_measurement
+
+    body = profile['body_measurement']
+    profile['targets'] = calculate_targets(profile['birthday'], body['height'], body['weight'],
+                                           body['gender'], body['activity_level'])
+    save_user_profile(user_id, profile)
+    return profile
+
+def profile_response(user_id, profile):
+    return {
+        'id': user_id,
+        'fullname': profile['fullname'],
+        'email': profile['email'],
+        'birthday': profile['birthday'],
+        'body_measurement': profile['body_measurement']
+    }
+
+def get_user_id_by_email(email):
+    # users_by_email/<email hash> -> user_id, a keyed read instead of a query over users
+    return read_node('users_by_email/' + hash_email(email))
+
+def claim_email_index(email, user_id):
+    # Returns False when the email already belongs to another user
+    index_ref = db.reference('users_by_email/' + hash_email(email))
+    owner = index_ref.transaction(lambda current: user_id if current is None else current)
+    reads.forget('users_by_email/' + hash_email(email))
+    return owner == user_id
+
+def release_email_index(email, user_id):
+    index_ref = db.reference('users_by_email/' + hash_email(email))
+    index_ref.transaction(lambda current: None if current == user_id else current)
+    reads.forget('users_by_email/' + hash_email(email))
+
+def iter_children(path, page_size=1000, start_after=None):
+    # Key-ordered paging so a whole tree is never held in memory
+    ref = db.reference(path)
+    while True:
+        query = ref.order_by_key()
+        if start_after is None:
+            page = query.limit_to_first(page_size).get()
+        else:
+            # start_at is inclusive, fetch one extra and drop the cursor itself
+            page = query.start_at(start_after).limit_to_first(page_size + 1).get()
+            if page:
+                page.pop(start_after, None)
+        if not page:
+            return
+        for key, value in page.items():
+            yield key, value
+        start_after = list(page.keys())[-1]
+        if len(page) < page_size:
+            return
+
+PUSH_CHARS = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+
+def generate_push_id(timestamp_ms, seed):
+    # Same layout as a Firebase push() key (8 time chars + 12 random chars), so keys
+    # still sort by time, but derived from `seed` so re-running an import is idempotent
+    time_chars = ''
+    for _ in range(8):
+        time_chars = PUSH_CHARS[timestamp_ms % 64] + time_chars
+        timestamp_ms //= 64
+    digest = hashlib.sha256(seed.encode('utf-8')).digest()
+    return time_chars + ''.join(PUSH_CHARS[byte % 64] for byte in digest[:12])
+
+def push_id_timestamp(push_id):
+    # Milliseconds encoded in the first 8 characters of a push key
+    timestamp_ms = 0
+    for char in push_id[:8]:
+        timestamp_ms = timestamp_ms * 64 + PUSH_CHARS.index(char)
+    return timestamp_ms